@@ -0,0 +1,366 @@
+from Bio.Data import IUPACData
+from Bio.PDB.Structure import Structure
+from Bio.PDB.StructureBuilder import StructureBuilder
+import numpy as np
+
+
+# ALA > A, only the 20 standard amino acids, like utils.filter_aa()
+THREE_TO_ONE = {
+    k.upper(): v for k, v in IUPACData.protein_letters_3to1.items()
+    if v in 'ARNDCQEGHILKMFPSTWYV'}
+
+
+def pdb_atom_name(name, element):
+    '''
+    Pad an atom name to the 4 characters of the PDB format, columns 13-16.
+    One-letter elements start in column 14, eg " CA " (carbon) vs "CA  "
+    (calcium).
+    '''
+    if len(name) < 4 and name[:1].isalpha() and len(element) < 2:
+        return f' {name:<3}'
+    return f'{name:<4}'
+
+
+# Backbone atoms, everything else in an amino acid is side chain
+BACKBONE = ('N', 'CA', 'C', 'O', 'OXT')
+
+
+# Arrays that define an AtomTable, derived ones like offsets are not listed
+COLUMNS = [
+    'coords', 'names', 'elements', 'bfactors', 'residue_index', 'res_names',
+    'res_ids', 'res_chains', 'res_hetero', 'res_icodes', 'occupancies',
+    'serials']
+
+# Cached values that do not depend on the coordinates, see .replace()
+LABEL_CACHE_KEYS = {'is_aa', 'masses', 'alpha_carbons', 'pdb_labels'}
+
+
+class AtomTable():
+    '''
+    Columnar (array) representation of the atoms in the first model of a
+    structure. Each atom is a row, the per-atom arrays are
+
+    - coords .. (n, 3) float32
+    - names .. atom names, eg "CA"
+    - elements .. element codes, eg "C"
+    - bfactors .. B-factor column (pLDDT for AlphaFold models)
+    - occupancies, serials
+    - residue_index .. index of the residue each atom belongs to
+
+    Residues are stored in the same order as in the file, each row in the
+    per-residue arrays (res_names, res_ids, res_icodes, res_chains,
+    res_hetero) is one residue, and the atoms of residue i are rows
+    offsets[i]:offsets[i+1].
+
+    table = AtomTable.from_structure(fold.structure)
+    table.coords[table.alpha_carbons()]
+    # array([[ 0.863, -24.961,  -8.055], ...
+
+    Treat a table as immutable: methods that change coordinates or labels
+    return a new table. This way derived values can be cached on the table
+    itself (see .cached()) and never go stale.
+    '''
+    def __init__(
+        self, coords, names, elements, bfactors, residue_index,
+        res_names, res_ids, res_chains, res_hetero=None, res_icodes=None,
+        occupancies=None, serials=None):
+
+        self.coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        self.names = np.asarray(names, dtype='U4')
+        self.elements = np.asarray(elements, dtype='U2')
+        self.bfactors = np.asarray(bfactors, dtype=np.float32)
+        self.residue_index = np.asarray(residue_index, dtype=np.int64)
+
+        n = len(self.names)
+        if occupancies is None:
+            occupancies = np.ones(n, dtype=np.float32)
+        self.occupancies = np.asarray(occupancies, dtype=np.float32)
+        if serials is None:
+            serials = np.arange(1, n + 1)
+        self.serials = np.asarray(serials, dtype=np.int64)
+
+        self.res_names = np.asarray(res_names, dtype='U3')
+        self.res_ids = np.asarray(res_ids, dtype=np.int64)
+        self.res_chains = np.asarray(res_chains, dtype='U4')
+        if res_hetero is None:
+            res_hetero = np.zeros(len(self.res_names), dtype=bool)
+        self.res_hetero = np.asarray(res_hetero, dtype=bool)
+        if res_icodes is None:
+            res_icodes = np.full(len(self.res_names), ' ')
+        self.res_icodes = np.asarray(res_icodes, dtype='U1')
+
+        # Atoms of residue i are in rows offsets[i]:offsets[i+1]
+        counts = np.bincount(self.residue_index, minlength=len(self.res_names))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._cache = {}
+        return None
+
+    @classmethod
+    def from_structure(cls, structure: Structure):
+        '''
+        Walk the Bio.PDB object tree once and collect the atoms of the first
+        model into arrays.
+        '''
+        model = next(iter(structure))
+        coords, names, elements, bfactors, residue_index = [], [], [], [], []
+        occupancies, serials = [], []
+        res_names, res_ids, res_chains, res_hetero, res_icodes = [], [], [], [], []
+
+        for chain in model:
+            for residue in chain:
+                ix = len(res_names)
+                res_names.append(residue.get_resname())
+                res_ids.append(residue.id[1])
+                res_icodes.append(residue.id[2])
+                res_chains.append(chain.id)
+                res_hetero.append(residue.id[0] != ' ')
+
+                for atom in residue:
+                    coords.append(atom.coord)
+                    names.append(atom.get_id())
+                    elements.append(atom.element)
+                    bfactors.append(atom.bfactor)
+                    occupancies.append(atom.occupancy)
+                    serials.append(atom.serial_number)
+                    residue_index.append(ix)
+
+        return cls(
+            coords, names, elements, bfactors, residue_index,
+            res_names, res_ids, res_chains, res_hetero, res_icodes,
+            occupancies, serials)
+
+    def to_structure(self, name: str='x') -> Structure:
+        '''
+        Build a Bio.PDB Structure from the table. This is the slow part we
+        want to avoid, so only call it when a Bio.PDB object is needed.
+        '''
+        sb = StructureBuilder()
+        sb.init_structure(name)
+        sb.init_model(0)
+        chain = None
+
+        for i in range(self.n_residues):
+            if self.res_chains[i] != chain:
+                chain = str(self.res_chains[i])
+                sb.init_chain(chain)
+                sb.init_seg('    ')
+
+            resname = str(self.res_names[i])
+            if not self.res_hetero[i]:
+                field = ' '
+            elif resname in ('HOH', 'WAT'):
+                field = 'W'
+            else:
+                field = 'H'
+            sb.init_residue(
+                resname, field, int(self.res_ids[i]), str(self.res_icodes[i]))
+
+            for j in range(self.offsets[i], self.offsets[i+1]):
+                name, element = str(self.names[j]), str(self.elements[j])
+                sb.init_atom(
+                    name, self.coords[j].copy(), float(self.bfactors[j]),
+                    float(self.occupancies[j]), ' ',
+                    pdb_atom_name(name, element), int(self.serials[j]),
+                    element)
+
+        return sb.get_structure()
+
+    def replace(self, **kwargs):
+        '''
+        New table with some arrays replaced, all other arrays are shared with
+        this table (not copied).
+
+        moved = table.replace(coords=table.coords + 1)
+        '''
+        arrays = self.arrays()
+        arrays.update(kwargs)
+        table = AtomTable(**arrays)
+
+        # Values derived from the labels stay valid if only coordinates change
+        if set(kwargs) == {'coords'}:
+            for k in LABEL_CACHE_KEYS & self._cache.keys():
+                table._cache[k] = self._cache[k]
+        return table
+
+    def subset(self, index):
+        '''
+        New table with only the atoms at <index> (in table order), residues
+        without any atoms left are dropped.
+
+        table.subset(table.alpha_carbons())
+        '''
+        index = np.sort(np.asarray(index, dtype=np.int64))
+        residues, residue_index = np.unique(
+            self.residue_index[index], return_inverse=True)
+
+        arrays = {}
+        for k, v in self.arrays().items():
+            if k == 'residue_index':
+                arrays[k] = residue_index
+            elif k.startswith('res_'):
+                arrays[k] = v[residues]
+            else:
+                arrays[k] = v[index]
+        return AtomTable(**arrays)
+
+    def arrays(self):
+        '''
+        The arrays that define the table, AtomTable(**table.arrays()) gives
+        the same table again.
+        '''
+        return {k: getattr(self, k) for k in COLUMNS}
+
+    def __len__(self):
+        '''Number of atoms'''
+        return len(self.names)
+
+    def __repr__(self):
+        return f'AtomTable with {len(self)} atoms in {self.n_residues} residues'
+
+    @property
+    def n_residues(self):
+        return len(self.res_names)
+
+    @property
+    def chains(self):
+        '''Chain id of each atom'''
+        return self.res_chains[self.residue_index]
+
+    @property
+    def is_aa(self):
+        '''Residue mask, True for the 20 standard amino acids'''
+        return self.cached('is_aa', lambda: np.isin(
+            self.res_names, list(THREE_TO_ONE.keys())))
+
+    @property
+    def masses(self):
+        '''Atomic weights, NaN for unknown elements like in Bio.PDB.Atom'''
+        def fn():
+            symbols, inverse = np.unique(self.elements, return_inverse=True)
+            weights = np.array([IUPACData.atom_weights.get(
+                i.capitalize(), np.nan) for i in symbols], dtype=np.float32)
+            return weights[inverse]
+        return self.cached('masses', fn)
+
+    def cached(self, key, fn):
+        '''
+        Compute a derived value once per table. Keys are tuples or strings,
+        eg ('kdtree', 'alpha_carbons').
+        '''
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = fn()
+            self._cache[key] = value
+            return value
+
+    def select(self, *names, residues=None):
+        '''
+        Index of atoms with the given names, by default only in amino acid
+        residues.
+
+        table.select('CA')
+        table.select('N', 'CA', 'C', 'O')
+        '''
+        if residues is None:
+            residues = self.is_aa
+        mask = np.isin(self.names, names) & residues[self.residue_index]
+        return np.flatnonzero(mask)
+
+    def alpha_carbons(self):
+        '''Index of the alpha carbon atoms, one per amino acid residue'''
+        return self.cached('alpha_carbons', lambda: self.select('CA'))
+
+    def sequence(self, chain=None):
+        '''One-letter amino acid sequence, optionally of a single chain'''
+        mask = self.is_aa
+        if chain is not None:
+            mask = mask & (self.res_chains == chain)
+        return ''.join(THREE_TO_ONE[i] for i in self.res_names[mask])
+
+    def positions(self):
+        '''
+        1-based position of each amino acid residue in its chain, like the
+        "position" annotation of Fold and Complex.
+        '''
+        chains = self.res_chains[self.is_aa]
+        positions = np.ones(len(chains), dtype=np.int64)
+        for chain in np.unique(chains):
+            mask = chains == chain
+            positions[mask] = np.arange(1, mask.sum() + 1)
+        return positions
+
+    def reduce_residues(self, values, ufunc=np.add):
+        '''
+        Segmented reduction of per-atom values to one value per residue, eg
+        the sum of the atom masses of each residue.
+
+        Empty residues (no atoms) are not expected in structures read from
+        disk.
+        '''
+        return ufunc.reduceat(values, self.offsets[:-1], axis=0)
+
+    def per_residue(self, values, how='first'):
+        '''
+        One value per residue from per-atom values, eg B-factors.
+
+        how .. first (atom of the residue), mean, min, max
+        '''
+        values = np.asarray(values)
+        if how == 'first':
+            return values[self.offsets[:-1]]
+        elif how == 'mean':
+            counts = np.diff(self.offsets)
+            return self.reduce_residues(values.astype(np.float64)) / counts
+        elif how == 'min':
+            return self.reduce_residues(values, np.minimum)
+        elif how == 'max':
+            return self.reduce_residues(values, np.maximum)
+        else:
+            raise ValueError('Method not implemented')
+
+    def centers_of_mass(self):
+        '''
+        Mass-weighted center of each amino acid residue, same as
+        Bio.PDB.Residue.center_of_mass() but for all residues at once.
+        '''
+        def fn():
+            m = self.masses.astype(np.float64)
+            weighted = self.reduce_residues(self.coords * m[:, None])
+            total = self.reduce_residues(m)
+            return (weighted / total[:, None])[self.is_aa].astype(np.float32)
+        return self.cached('centers_of_mass', fn)
+
+    def centroids(self):
+        '''
+        Unweighted mean of the atom coordinates of each amino acid residue.
+        '''
+        def fn():
+            counts = np.diff(self.offsets)
+            total = self.reduce_residues(self.coords.astype(np.float64))
+            return (total / counts[:, None])[self.is_aa].astype(np.float32)
+        return self.cached('centroids', fn)
+
+    def side_chain_centroids(self):
+        '''
+        Unweighted mean of the heavy side chain atoms of each amino acid
+        residue, the alpha carbon for glycine (and residues with no side chain
+        atoms in the file), the centroid of the residue if it has no alpha
+        carbon either. A pseudo single-atom representation of side chains, see
+        Kiefl et al. (2022).
+        '''
+        def fn():
+            side = ~np.isin(self.names, BACKBONE) & ~np.isin(self.elements, ['H', 'D'])
+            counts = self.reduce_residues(side.astype(np.int64))[self.is_aa]
+            total = self.reduce_residues(
+                np.where(side[:, None], self.coords, 0).astype(np.float64))[self.is_aa]
+
+            # One row per amino acid, whether or not it has an alpha carbon
+            points = self.centroids().copy()
+            ca = self.alpha_carbons()
+            aa_index = np.cumsum(self.is_aa) - 1
+            points[aa_index[self.residue_index[ca]]] = self.coords[ca]
+            has_side = counts > 0
+            points[has_side] = total[has_side] / counts[has_side, None]
+            return points
+        return self.cached('side_chain_centroids', fn)
@@ -1,30 +1,143 @@
 # import shutil
+import os
+from pathlib import Path
+import re
 import subprocess
 import tempfile
 from typing import Union
 
+from Bio.Data.PDBData import residue_sasa_scales
 from Bio.PDB.Residue import Residue
+from Bio.PDB.SASA import ATOMIC_RADII
 from Bio.PDB.Atom import Atom
-from libpysal.weights import DistanceBand
 import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
 import screed
 
-from foldvis.geometry import get_coordinate, is_close, euclidean_distance
+from foldvis.atoms import BACKBONE
+from foldvis.io import get_cache_dir, hash_file
+
+
+# Theoretical maximum SASA per residue type, Tien et al. (2013)
+MAX_ASA = residue_sasa_scales['Wilke']
 
 
 def get_alpha_carbon_atoms(fold, only_coords=False):
     '''
     alpha carbon: https://foldit.fandom.com/wiki/Alpha_carbon
+
+    For coordinates only, get_alpha_carbon_coords() returns them as one array
+    and does not walk the Bio.PDB object tree.
     '''
+    if only_coords:
+        yield from get_alpha_carbon_coords(fold)
+        return
+
     for res in fold.structure.get_residues():
         l = []
         for i in res.get_atoms():
             # There is only one alpha carbon per amino acid.
             if i.get_id() == 'CA':
-                if only_coords:
-                    yield i.coord
-                else:
-                    yield i
+                yield i
+
+
+def get_alpha_carbon_coords(fold):
+    '''
+    (n, 3) array with one alpha carbon per amino acid, read from the atom
+    table of a Fold or Complex. Does not load all atoms of a Fold loaded with
+    load='ca'.
+    '''
+    atoms = fold.ca_atoms
+    return atoms.coords[atoms.alpha_carbons()]
+
+
+def get_residue_coordinates(fold, coordinates='alpha_carbons'):
+    '''
+    One coordinate per amino acid residue, computed once per fold.
+
+    coordinates .. alpha_carbons, center_of_mass, centroid (of all atoms),
+    side_chain (centroid of the side chain, alpha carbon for glycine)
+    '''
+    if coordinates == 'alpha_carbons':
+        return get_alpha_carbon_coords(fold)
+    elif coordinates == 'center_of_mass':
+        return fold.atoms.centers_of_mass()
+    elif coordinates == 'centroid':
+        return fold.atoms.centroids()
+    elif coordinates == 'side_chain':
+        return fold.atoms.side_chain_centroids()
+    else:
+        raise ValueError('Unsupported coordinates')
+
+
+def residue_table(fold, coordinates):
+    '''
+    Atom table that the residue coordinates are computed from, derived
+    values (like the spatial index) are cached on it, see AtomTable.cached().
+    '''
+    if coordinates == 'alpha_carbons':
+        return fold.ca_atoms
+    return fold.atoms
+
+
+def get_spatial_index(fold, coordinates='alpha_carbons') -> cKDTree:
+    '''
+    KD-tree over the residue coordinates, built on first use and cached for
+    the fold and coordinate mode. A transformed fold has a new atom table and
+    thus gets a new index.
+
+    https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.cKDTree.html
+    '''
+    table = residue_table(fold, coordinates)
+    return table.cached(('kdtree', coordinates), lambda: cKDTree(
+        get_residue_coordinates(fold, coordinates)))
+
+
+def points_within(points, radius, tree=None) -> csr_matrix:
+    '''
+    Sparse (n, n) boolean matrix for an (n, 3) array of <points>, True where
+    two points are closer than <radius>, without the diagonal. See
+    neighbors_within() for residues of a fold.
+
+    tree .. a cKDTree over the points, if there is one already
+    '''
+    if tree is None:
+        tree = cKDTree(points)
+    pairs = tree.query_pairs(radius, output_type='ndarray')
+    # query_pairs includes distance == radius, is_close() did not
+    X = tree.data
+    d = np.linalg.norm(X[pairs[:, 0]] - X[pairs[:, 1]], axis=1)
+    i, j = pairs[d < radius].T
+    n = len(X)
+    data = np.ones(2 * len(i), dtype=bool)
+    return csr_matrix((data, (np.r_[i, j], np.r_[j, i])), shape=(n, n))
+
+
+def neighbors_within(fold, radius, coordinates='alpha_carbons') -> csr_matrix:
+    '''
+    Sparse (residues, residues) boolean matrix, True where two residues are
+    closer than <radius> (Angstrom). The diagonal is not set. One query on the
+    spatial index answers this for all residues at once.
+
+    nb = neighbors_within(fold, 8)
+    nb[0].indices  # neighbors of the first residue
+    '''
+    def fn():
+        tree = get_spatial_index(fold, coordinates)
+        return points_within(tree.data, radius, tree)
+
+    table = residue_table(fold, coordinates)
+    return table.cached(('neighbors', coordinates, radius), fn)
+
+
+def count_within(fold, radius, coordinates='alpha_carbons'):
+    '''
+    Number of other residues closer than <radius> for each residue, eg as a
+    simple measure of how buried a residue is.
+    '''
+    return np.diff(neighbors_within(fold, radius, coordinates).indptr)
 
 
 def get_coordinate(x: Union[Atom, Residue]):
@@ -53,9 +166,12 @@ def is_close(pos, fold, radius, coordinates='alpha_carbons'):
     list(is_close(1, fold, 10))
     # [True, True, True, True, True, False, False, ...]
 
-    coordinates .. center_of_mass, alpha_carbon
+    coordinates .. alpha_carbons, center_of_mass, centroid, side_chain, see
+    get_residue_coordinates()
+
+    For all residues at once, use neighbors_within() or count_within().
 
-    TODO: pseudo single-atom representation of side chains:
+    side_chain is a pseudo single-atom representation of side chains:
 
     > Specifically, we defined this distance according to the sites' side chain
     center of masses. A consequence of approximating DTL with respect to the
@@ -66,49 +182,243 @@ def is_close(pos, fold, radius, coordinates='alpha_carbons'):
     - https://pymolwiki.org/index.php/Sidechaincenters
     - https://bioinformatics.stackexchange.com/questions/18162/pymol-python-script-for-selecting-a-residues-sidechain-and-calculating-its-cent
     '''
+    # The neighbors of all residues are computed (and cached) at once, so
+    # calling this for every position does not repeat any distance work.
+    nb = neighbors_within(fold, radius, coordinates)
+    mask = np.zeros(nb.shape[0], dtype=bool)
+    mask[nb.indices[nb.indptr[pos]:nb.indptr[pos + 1]]] = True
+    mask[pos] = radius > 0
+    yield from mask.tolist()
+
+
+def _sphere_points(n):
+    '''
+    <n> points evenly spaced on the unit sphere (golden spiral), the same as
+    in Bio.PDB.SASA.ShrakeRupley.
+    '''
+    dz = 2.0 / n
+    z = 1 - dz / 2 - dz * np.arange(n)
+    longitude = np.pi * (3 - 5**0.5) * np.arange(n)
+    r = np.sqrt(1 - z * z)
+    return np.stack([np.cos(longitude) * r, np.sin(longitude) * r, z], axis=1)
+
+
+def solvent_accessibility(fold, relative=True, probe=1.4, n_points=100, batch=2**20):
+    '''
+    from foldvis.models import Fold
+    from foldvis.geometry import solvent_accessibility
+
+    fold = Fold('test_676a7_unrelaxed_rank_1_model_2.pdb')
+    rsa = solvent_accessibility(fold)
+    # array([0.94, 0.71, 0.35, ...
+
+    Solvent accessible surface area (SASA) of each amino acid residue, by
+    default relative to the maximum of its residue type (Tien et al., 2013).
+    Same as Bio.PDB.SASA.ShrakeRupley (atomic radii, sphere points), but for
+    all atoms at once:
+
+    1. Each atom gets a sphere of <n_points> points at its radius plus the
+    <probe> radius.
+    2. Atom pairs whose spheres overlap come from one spatial index query.
+    3. For all pairs, in batches of about <batch> point tests, the points of
+    the first atom that lie inside the sphere of the second are buried.
+
+    All atoms in the structure (including ligands) occlude the surface.
+    Relative values can be slightly above 1 for terminal residues.
+
+    "Environment and exposure to solvent of protein atoms. Lysozyme and
+    insulin", Shrake & Rupley, J Mol Biol, 1973
+    '''
+    def fn():
+        table = fold.atoms
+        X = table.coords.astype(np.float64)
+        R = np.array([
+            ATOMIC_RADII.get(str(e).upper(), 2.0) for e in table.elements]) + probe
+        S = _sphere_points(n_points)
+
+        tree = cKDTree(X)
+        pairs = tree.query_pairs(2 * R.max(), output_type='ndarray')
+        i, j = np.r_[pairs[:, 0], pairs[:, 1]], np.r_[pairs[:, 1], pairs[:, 0]]
+        order = np.argsort(i, kind='stable')
+        i, j = i[order], j[order]
+        v = X[i] - X[j]
+        d2 = (v ** 2).sum(axis=1)
+        overlap = d2 < (R[i] + R[j]) ** 2
+        i, j, v, d2 = i[overlap], j[overlap], v[overlap], d2[overlap]
+
+        # |x_i + r_i * s - x_j|^2 <= r_j^2 .. point s of atom i is buried,
+        # or s . (x_i - x_j) <= (r_j^2 - r_i^2 - |x_i - x_j|^2) / (2 r_i).
+        # Pairs are sorted by i so each batch reduces to whole atoms.
+        cutoff = (R[j] ** 2 - R[i] ** 2 - d2) / (2 * R[i])
+        buried = np.zeros((len(X), n_points), dtype=bool)
+        starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]]) if len(i) else i
+        step = max(1, batch // n_points)
+        a = 0
+        while a < len(starts):
+            b = max(a + 1, np.searchsorted(starts, starts[a] + step) - 1)
+            lo = starts[a]
+            hi = starts[b] if b < len(starts) else len(i)
+            k = slice(lo, hi)
+            inside = v[k] @ S.T <= cutoff[k, None]
+            buried[i[starts[a:b]]] = np.logical_or.reduceat(inside, starts[a:b] - lo, axis=0)
+            a = b
+
+        exposed = n_points - buried.sum(axis=1)
+        area = exposed * R ** 2 * (4 * np.pi / n_points)
+        return table.reduce_residues(area)[table.is_aa]
+
+    table = fold.atoms
+    sasa = table.cached(('sasa', probe, n_points), fn)
+    if not relative:
+        return sasa
+    names = table.res_names[table.is_aa]
+    return sasa / np.array([MAX_ASA[i] for i in names])
+
+
+def kabsch(mobile, reference, weights=None):
+    '''
+    Rotation and translation that superimpose the (n, 3) points <mobile> onto
+    the corresponding points <reference> with minimal (weighted) RMSD, in the
+    convention of Bio.PDB's .transform(): mobile @ rot + tra.
+
+    https://en.wikipedia.org/wiki/Kabsch_algorithm
+    '''
+    X = np.asarray(mobile, dtype=np.float64)
+    Y = np.asarray(reference, dtype=np.float64)
+    w = np.ones(len(X)) if weights is None else np.asarray(weights, dtype=np.float64)
+    w = w / w.sum()
 
-    if coordinates == 'center_of_mass':
-        chain = list(fold.structure.get_residues())
-    
-    elif coordinates == 'alpha_carbons':
-        chain = list(get_alpha_carbon_atoms(fold))
-    
-    a = get_coordinate(chain[pos])
+    mx, my = w @ X, w @ Y
+    H = ((X - mx) * w[:, None]).T @ (Y - my)
+    U, _, Vt = np.linalg.svd(H)
+    # Reflection correction, keep a proper rotation
+    D = np.diag([1, 1, np.sign(np.linalg.det(U @ Vt))])
+    rot = U @ D @ Vt
+    return rot, my - mx @ rot
 
-    for i in chain:
-        b = get_coordinate(i)
-        # https://stackoverflow.com/questions/1401712/how-can-the-euclidean-distance-be-calculated-with-numpy
-        # dist = np.linalg.norm(a - b)
-        dist = euclidean_distance(a, b)
-        if dist < radius:
-            yield True
-        else:
-            yield False
+
+def tm_d0(n):
+    '''
+    Distance scale of the TM-score for a protein of <n> residues (Zhang &
+    Skolnick, 2004), at least 0.5 like in TM-align.
+    '''
+    return max(0.5, 1.24 * np.cbrt(max(n - 15, 1)) - 1.8)
+
+
+def superimpose(mobile, reference, iterations=20):
+    '''
+    from foldvis.geometry import get_alpha_carbon_coords, superimpose
+
+    tmscore, rmsd, rot, tra = superimpose(
+        get_alpha_carbon_coords(model), get_alpha_carbon_coords(ref))
+    aligned = model.transform(rot, tra)
+
+    Superposition of corresponding points (eg the alpha carbons of two models
+    of the same sequence) that maximizes the TM-score: start from the Kabsch
+    superposition of all points, then repeatedly weight each point by its TM
+    score term 1 / (1 + (d / d0)^2) so that well aligned regions dominate and
+    flexible ones (loops, termini) are down-weighted, until the score stops
+    improving. RMSD is over all points after the final superposition, the
+    TM-score is normalized by the length of <reference>.
+    '''
+    X = np.asarray(mobile, dtype=np.float64)
+    Y = np.asarray(reference, dtype=np.float64)
+    assert X.shape == Y.shape, 'Points do not correspond'
+    d0 = tm_d0(len(Y))
+
+    best = None
+    rot, tra = kabsch(X, Y)
+    for _ in range(iterations):
+        d = np.linalg.norm(X @ rot + tra - Y, axis=1)
+        terms = 1 / (1 + (d / d0) ** 2)
+        tmscore = terms.sum() / len(Y)
+        if best is not None and tmscore <= best[0] + 1e-6:
+            break
+        best = tmscore, np.sqrt((d ** 2).mean()), rot, tra
+        rot, tra = kabsch(X, Y, terms)
+
+    tmscore, rmsd, rot, tra = best
+    return float(tmscore), float(rmsd), rot, tra
 
 
 def get_foldseek_vae_states(fold):
     '''
     https://github.com/steineggerlab/foldseek/issues/15
+
+    3Di string of a single fold, see get_3di_states() for many.
     '''
-    tmp = tempfile.TemporaryDirectory()
-    p = tmp.name
-    fp = fold.path.resolve().__str__()
+    return get_3di_states([fold])[0]
+
+
+def _3di_entry(key: str) -> Path:
+    return get_cache_dir() / '3di' / f'{key}.txt'
+
 
-    steps = [
-        f'foldseek createdb {fp} {p}/db',
-        f'foldseek lndb {p}/db_h {p}/db_ss_h',
-        f'foldseek convert2fasta {p}/db_ss {p}/db_ss.fasta',
-    ]
-    command = '; '.join(steps)
-    log = subprocess.run(command, capture_output=True, shell=True)
-    assert log.returncode == 0, log.stderr
+def get_3di_states(folds, cache=True, threads=None):
+    '''
+    from foldvis.geometry import get_3di_states
 
-    # shutil.copyfile(f'{p}/db_ss.fasta', outfile)
-    with screed.open(f'{p}/db_ss.fasta') as file:
-       return next(file).sequence
+    states = get_3di_states(folds)  # or paths
+    # ['DVVVVVVVVVVVVVLVVQQDCVVVVHDPDDD...', ...]
 
+    3Di strings (the structural alphabet of foldseek, one state per residue)
+    for many folds or paths with one foldseek createdb over all of them. For
+    structures with several chains, the first one is returned.
 
-def distance_to_closest_active_site(fold, binding_frequencies, threshold=0.5):
+    Strings are cached on disk (see foldvis.io.get_cache_dir()), keyed on
+    the content hash of the file, so a structure is only encoded once, even
+    if it is moved or copied. Only the structures not in the cache are passed
+    to foldseek.
+    '''
+    paths = [Path(getattr(i, 'path', i)).resolve() for i in folds]
+    keys = [hash_file(fp) for fp in paths]
+    states = [None] * len(paths)
+
+    if cache:
+        for n, key in enumerate(keys):
+            entry = _3di_entry(key)
+            if entry.exists():
+                states[n] = entry.read_text()
+
+    todo = [n for n, i in enumerate(states) if i is None]
+    if todo:
+        with tempfile.TemporaryDirectory() as p:
+            indir = Path(p) / 'structures'
+            indir.mkdir()
+            for n in todo:
+                fp = paths[n]
+                (indir / f'{n}{"".join(fp.suffixes)}').symlink_to(fp)
+
+            threads = ['--threads', str(threads)] if threads else []
+            steps = [
+                ['foldseek', 'createdb', str(indir), f'{p}/db', *threads],
+                ['foldseek', 'lndb', f'{p}/db_h', f'{p}/db_ss_h'],
+                ['foldseek', 'convert2fasta', f'{p}/db_ss', f'{p}/db_ss.fasta'],
+            ]
+            for step in steps:
+                log = subprocess.run(step, capture_output=True)
+                assert log.returncode == 0, log.stderr
+
+            # Records are named after the files, eg "3.pdb" or "3.pdb_A"
+            with screed.open(f'{p}/db_ss.fasta') as file:
+                for record in file:
+                    n = int(re.match(r'\d+', record.name).group(0))
+                    if states[n] is None:
+                        states[n] = record.sequence
+
+        for n in todo:
+            assert states[n] is not None, f'No 3Di states for {paths[n]}'
+            if cache:
+                entry = _3di_entry(keys[n])
+                entry.parent.mkdir(parents=True, exist_ok=True)
+                tmp = entry.with_suffix(f'.{os.getpid()}.tmp')
+                tmp.write_text(states[n])
+                os.replace(tmp, entry)
+
+    return states
+
+
+def distance_to_closest_active_site(fold, binding_frequencies, threshold=0.5, coordinates='center_of_mass'):
     '''
     Usage:
 
@@ -117,67 +427,360 @@ def distance_to_closest_active_site(fold, binding_frequencies, threshold=0.5):
     b.predict_binding_(pfam)
     bf = b.get_binding('PF00464.18', 'SER')
     distance_to_closest_active_site(f, bf, .5)
+
+    Residues with a binding frequency >= threshold are active sites. The
+    residue centers are computed once per fold (see get_residue_coordinates)
+    and the closest active site for all residues is one query on a KD-tree
+    of the active sites.
+
+    Batches return a (residues, columns) array instead of a list:
+
+    - several thresholds .. one column per threshold
+    - several binding frequency vectors, eg one per (domain, ligand) pair,
+    stacked as columns of a (residues, k) array .. one column per vector, or
+    k * len(threshold) columns (vector-major) for several thresholds
+
+    bf = np.column_stack([b.get_binding(d, l) for d, l in pairs])
+    distance_to_closest_active_site(f, bf, [.25, .5, .75])
+
+    If there are no active sites, the distance is inf.
     '''
-    residues = list(fold.structure.get_residues())
-    bf = binding_frequencies
+    residues = get_residue_coordinates(fold, coordinates)
+    bf = np.asarray(binding_frequencies, dtype=float)
+    single = bf.ndim == 1 and np.ndim(threshold) == 0
 
+    bf = bf.reshape(len(bf), -1)
+    thresholds = np.atleast_1d(threshold)
     assert len(residues) == len(bf) 
-    active = [r for r, f in zip(residues, bf) if f >= threshold]
 
-    l = []
-    for r in residues:
-        rm = r.center_of_mass()
-        d = np.min([euclidean_distance(rm, a.center_of_mass()) for a in active])
-        l.append(float(d))
-    
-    return l
+    columns = []
+    for v in bf.T:
+        for t in thresholds:
+            active = residues[v >= t]
+            if len(active) == 0:
+                columns.append(np.full(len(residues), np.inf))
+                continue
+            d, _ = cKDTree(active).query(residues)
+            columns.append(d)
+    result = np.column_stack(columns)
+
+    if single:
+        return result[:, 0].tolist()
+    return result
 
 
-def get_complex_interface(cx, angstrom=10):
+def select_atoms(table, atoms='alpha_carbons'):
+    '''
+    Index of the atoms in the amino acids of a table to measure contacts
+    with.
+
+    atoms .. alpha_carbons, heavy (all but hydrogen), side_chain (heavy side
+    chain atoms, the alpha carbon for glycine)
+    '''
+    if atoms == 'alpha_carbons':
+        return table.alpha_carbons()
+
+    aa = table.is_aa[table.residue_index]
+    heavy = aa & (table.elements != 'H') & (table.elements != 'D')
+    if atoms == 'heavy':
+        return np.flatnonzero(heavy)
+    elif atoms == 'side_chain':
+        side = heavy & ~np.isin(table.names, BACKBONE)
+        glycine = (table.res_names == 'GLY')[table.residue_index]
+        side |= glycine & (table.names == 'CA') & aa
+        return np.flatnonzero(side)
+    else:
+        raise ValueError('Unsupported atoms')
+
+
+def get_interfaces(cx, angstrom=10, atoms='alpha_carbons') -> pd.DataFrame:
+    '''
+    Residue contacts between all pairs of chains in a complex.
+
+    from foldvis.models import Complex
+    from foldvis.geometry import get_interfaces
+
+    cx = Complex('/path/to/model.pdb')
+    contacts = get_interfaces(cx, 5, 'heavy')
+    #   chain_a chain_b  residue_a  residue_b  position_a  position_b  distance
+    # 0       B       C         12       1010          13         106     4.12
+    # ...
+
+    Two residues are in contact if any of their selected atoms (see
+    select_atoms()) are closer than <angstrom>; distance is the smallest of
+    these atom distances. residue_* index the residues of the complex like
+    the annotation (0-based, over all chains), position_* count from 1 in
+    each chain. Each chain gets its own KD-tree, and all contacts between
+    two chains are one sparse cross query of their trees.
+    '''
+    table = cx.ca_atoms if atoms == 'alpha_carbons' else cx.atoms
+    ix = select_atoms(table, atoms)
+
+    # Map atoms to amino acid residues (rows of the annotation)
+    aa_index = np.cumsum(table.is_aa) - 1
+    residues = aa_index[table.residue_index[ix]]
+    chains = table.chains[ix]
+    coords = table.coords[ix]
+    positions = table.positions()
+
+    trees = {}
+    for chain in dict.fromkeys(chains.tolist()):
+        members = np.flatnonzero(chains == chain)
+        trees[chain] = (members, cKDTree(coords[members]))
+
+    columns = ['chain_a', 'chain_b', 'residue_a', 'residue_b', 'position_a', 'position_b', 'distance']
+    frames = []
+    names = list(trees)
+    for n, a in enumerate(names):
+        for b in names[n+1:]:
+            (ma, ta), (mb, tb) = trees[a], trees[b]
+            pairs = ta.sparse_distance_matrix(tb, angstrom, output_type='ndarray')
+            pairs = pairs[pairs['v'] < angstrom]
+            if len(pairs) == 0:
+                continue
+            df = pd.DataFrame({
+                'residue_a': residues[ma[pairs['i']]],
+                'residue_b': residues[mb[pairs['j']]],
+                'distance': pairs['v'],
+                })
+            df = df.groupby(['residue_a', 'residue_b'], as_index=False)['distance'].min()
+            df['chain_a'], df['chain_b'] = a, b
+            frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    df['position_a'] = positions[df['residue_a']]
+    df['position_b'] = positions[df['residue_b']]
+    return df[columns]
+
+
+# Residue representations for distance_matrix() and contact_map()
+REPRESENTATIONS = ('alpha_carbons', 'beta_carbons', 'centroid', 'side_chain', 'heavy')
+
+
+def _representation_points(fold, representation):
+    '''
+    Points to measure distances between and the offsets of the points of
+    each amino acid residue in them (one point per residue except for
+    "heavy").
+    '''
+    table = fold.atoms if representation != 'alpha_carbons' else None
+    offsets = None
+    if representation == 'alpha_carbons':
+        X = get_alpha_carbon_coords(fold)
+    elif representation == 'beta_carbons':
+        # Glycine has no beta carbon, use the alpha carbon instead, and the
+        # centroid for residues without either
+        X = table.centroids().copy()
+        aa_index = np.cumsum(table.is_aa) - 1
+        for atoms in (table.alpha_carbons(), table.select('CB')):
+            X[aa_index[table.residue_index[atoms]]] = table.coords[atoms]
+    elif representation in ('centroid', 'side_chain'):
+        X = get_residue_coordinates(fold, representation)
+    elif representation == 'heavy':
+        ix = select_atoms(table, 'heavy')
+        aa_index = np.cumsum(table.is_aa) - 1
+        counts = np.bincount(
+            aa_index[table.residue_index[ix]], minlength=table.is_aa.sum())
+        assert (counts > 0).all(), 'Residue without heavy atoms'
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        X = table.coords[ix]
+    else:
+        raise ValueError('Unsupported representation')
+
+    if offsets is None:
+        offsets = np.arange(len(X) + 1)
+    return np.asarray(X, dtype=np.float32), offsets
+
+
+def iter_distance_tiles(fold, representation='alpha_carbons', memory=2**24):
+    '''
+    Residue distances as row blocks (start, stop, float32 tile of shape
+    (stop - start, residues)), so that the intermediate arrays of each block
+    stay below <memory> bytes.
+
+    representation .. alpha_carbons, beta_carbons (alpha carbon for glycine,
+    residue centroid without either),
+    centroid, side_chain (see get_residue_coordinates()), heavy (minimum distance between heavy atoms)
+    '''
+    X, offsets = _representation_points(fold, representation)
+    return _distance_tiles(X, offsets, memory)
+
+
+def _distance_tiles(X, offsets, memory):
+    n, m = len(offsets) - 1, len(X)
+
+    # Per row atom: (m,) float32 squared distances, a (m,) float32 buffer for
+    # one coordinate and (n,) float32 for the column minima of heavy atoms or
+    # the previous tile, which the caller may still hold
+    rows = max(1, memory // (m * 8 + n * 4))
+    start = 0
+    while start < n:
+        # Tiles hold whole residues, at least one even if it exceeds <memory>
+        stop = max(start + 1, np.searchsorted(
+            offsets, offsets[start] + rows, side='right') - 1)
+        stop = min(stop, n)
+        a, b = offsets[start], offsets[stop]
+
+        # Sum of squared coordinate differences, in place and in float32
+        d = np.zeros((b - a, m), dtype=np.float32)
+        buffer = np.empty_like(d)
+        for k in range(3):
+            np.subtract.outer(X[a:b, k], X[:, k], out=buffer)
+            np.square(buffer, out=buffer)
+            d += buffer
+        del buffer
+
+        if m != n:
+            # Minimum over the atoms of each residue, columns then rows
+            d = np.minimum.reduceat(d, offsets[:-1], axis=1)
+            d = np.minimum.reduceat(d, offsets[start:stop] - a, axis=0)
+        yield start, stop, np.sqrt(d, out=d)
+        start = stop
+
+
+def distance_matrix(fold, representation='alpha_carbons', output='dense', cutoff=None, memory=2**24, path=None):
+    '''
+    from foldvis.models import Fold
+    from foldvis.geometry import distance_matrix
+
+    fold = Fold('test_676a7_unrelaxed_rank_1_model_2.pdb')
+    D = distance_matrix(fold, 'beta_carbons')
+    D = distance_matrix(fold, 'heavy', output='sparse', cutoff=8)
+    D = distance_matrix(fold, output='memmap', path='distances.npy')
+
+    (residues, residues) float32 distances between amino acid residues,
+    computed in tiles (see iter_distance_tiles()) so the working memory stays
+    below <memory> bytes.
+
+    output .. dense (array), sparse (CSR matrix of the distances below
+    <cutoff>, without the diagonal), memmap (.npy file at <path>, opened with
+    np.load(path, mmap_mode='r'))
+    '''
+    X, offsets = _representation_points(fold, representation)
+    tiles = _distance_tiles(X, offsets, memory)
+    n = len(offsets) - 1
+
+    if output == 'dense':
+        D = np.empty((n, n), dtype=np.float32)
+    elif output == 'memmap':
+        assert path, 'Memory-mapped output needs a path'
+        D = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, n))
+    elif output == 'sparse':
+        assert cutoff is not None, 'Sparse output needs a cutoff'
+        rows, cols, data = [], [], []
+        for start, stop, d in tiles:
+            i, j = np.nonzero(d < cutoff)
+            i += start
+            keep = i != j
+            rows.append(i[keep])
+            cols.append(j[keep])
+            data.append(d[i[keep] - start, j[keep]])
+        return csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n, n), dtype=np.float32)
+    else:
+        raise ValueError('Method not implemented')
+
+    for start, stop, d in tiles:
+        D[start:stop] = d
+    if output == 'memmap':
+        D.flush()
+    return D
+
+
+def contact_map(fold, angstrom=8, representation='beta_carbons', sparse=False, memory=2**24):
+    '''
+    Boolean (residues, residues) map of residues closer than <angstrom>, by
+    default between beta carbons (a common contact definition). The diagonal
+    is set for the dense map, not the sparse one.
+    '''
+    if sparse:
+        D = distance_matrix(fold, representation, 'sparse', angstrom, memory)
+        return D.astype(bool)
+
+    X, offsets = _representation_points(fold, representation)
+    n = len(offsets) - 1
+    C = np.empty((n, n), dtype=bool)
+    for start, stop, d in _distance_tiles(X, offsets, memory):
+        C[start:stop] = d < angstrom
+    return C
+
+
+def get_complex_interface(cx, angstrom=10, chain=None, atoms='alpha_carbons'):
     '''
     from foldvis.models import Complex
     from foldvis.geometry import get_complex_interface
 
     cx = Complex('/path/to/model.pdb')
     interface = get_complex_interface(cx, 10)
+
+    Set of residues (0-based, over all chains) in contact with another chain,
+    optionally only those of one <chain>. See get_interfaces() for the
+    contacts themselves.
     '''
-    coords = []
-    labels = []
-    for chain in cx.chains:
-        # TODO: Add a more general iterator, for both complexes and single folds
-        for atom in chain.get_atoms():
-            if atom.get_id() == 'CA':
-                coords.append(get_coordinate(atom))
-                labels.append(chain.id)
-                
-    lu = {i: j for i, j in enumerate(labels)}
-    dist = DistanceBand(coords, 10, p=2, binary=True)
-    assert len(dist.neighbors.keys()) == len(cx)
-    
+    df = get_interfaces(cx, angstrom, atoms)
     interface = set()
-    for k, v in dist.neighbors.items():
-        origin = lu[k]
-        for i in v:
-            if lu[i] != origin and origin == 'B':
-                interface.add(k)
-    
+    for side in 'ab':
+        sub = df if chain is None else df[df[f'chain_{side}'] == chain]
+        interface.update(sub[f'residue_{side}'].tolist())
     return interface
 
 
-def distance_to_positions(model, positions):
+def residue_index(fold, positions, coordinates='alpha_carbons') -> np.ndarray:
+    '''
+    Index into the residue coordinates (0-based, over all chains) from
+
+    - an iterable of such indices, eg the set from get_complex_interface();
+    indices outside the structure are ignored
+    - a boolean mask over all residues
+    - a dict {chain: positions}, where positions count from 1 within each
+    chain like the "position" annotation of a Complex
+
+    residue_index(cx, {'A': [1, 2, 3], 'B': [10]})
+    # array([  0,   1,   2, 913])  .. if chain A has 904 residues
+    '''
+    n = len(get_residue_coordinates(fold, coordinates))
+
+    if isinstance(positions, dict):
+        table = residue_table(fold, coordinates)
+        chains = table.res_chains[table.is_aa]
+        within = table.positions()
+        l = [np.flatnonzero((chains == chain) & np.isin(within, list(p)))
+            for chain, p in positions.items()]
+        return np.unique(np.concatenate(l)) if l else np.array([], dtype=np.int64)
+
+    positions = np.asarray(list(positions))
+    if positions.dtype == bool:
+        assert len(positions) == n, 'Mask has wrong dimensions'
+        return np.flatnonzero(positions)
+
+    positions = positions.astype(np.int64)
+    return positions[(positions >= 0) & (positions < n)]
+
+
+def distance_to_positions(model, positions, coordinates='alpha_carbons'):
     '''
     from foldvis.models import Complex
     from foldvis.geometry import get_complex_interface, distance_to_positions
 
     cx = Complex('/path/to/model.pdb')
     interface = get_complex_interface(cx, 10)
-    distance_to_interface = distance_to_positions(model, interface)
-    '''
-    atoms = list(get_alpha_carbon_atoms(model, only_coords=True))
-    l = []
-    for atom in atoms:
-        # Restrict positions to only those in the protein structure, ignore the rest
-        dist = np.min([euclidean_distance(atom, atoms[p]) for p in positions if p in range(len(model))])
-        l.append(dist)
-    return l
+    distance_to_interface = distance_to_positions(cx, interface)
+
+    # Positions per chain, counting from 1 in each chain
+    distance_to_positions(cx, {'A': [12, 13], 'B': range(1, 20)})
 
+    Positions can be anything residue_index() takes. The distance from every
+    residue to the closest of the positions is one query on a KD-tree over
+    the positions; it is inf if no position is in the structure.
+    '''
+    X = get_residue_coordinates(model, coordinates)
+    # Restrict positions to only those in the protein structure, ignore the rest
+    ix = residue_index(model, positions, coordinates)
+    if len(ix) == 0:
+        return [float('inf')] * len(X)
+
+    dist, _ = cKDTree(X[ix]).query(X)
+    return dist.tolist()
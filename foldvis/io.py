@@ -1,19 +1,45 @@
 from collections import defaultdict
+from contextlib import nullcontext
+import gzip
+import hashlib
 from io import StringIO
 import json
+import os
 from pathlib import Path
-from typing import Union
+import re
+import shutil
+import tempfile
+from typing import BinaryIO, Iterable, Union
 
-from Bio import PDB, SeqUtils
+from Bio import PDB
 from Bio.PDB import PDBIO, Structure
-from Bio.PDB.PDBParser import PDBParser
+import numpy as np
 import pandas as pd
 import screed
 
+from foldvis.atoms import AtomTable, COLUMNS, pdb_atom_name
 from foldvis.utils import entropy, mean_pairwise_similarity
 
 
-def save_pdb(structure: Structure, out: Union[str, Path, StringIO]) -> None:
+def save_pdb(structure: Union[Structure, AtomTable], out: Union[str, Path, StringIO]) -> None:
+    '''
+    Pass an AtomTable (eg fold.atoms) instead of a Bio.PDB structure to
+    write it with format_pdb(), which is much faster than PDBIO.
+    '''
+    if isinstance(structure, AtomTable):
+        text = format_pdb(structure)
+
+        if type(out) == StringIO:
+            out.write(text)
+            return out
+        else:
+            p = Path(out)
+            if not p.parent.exists():
+                p.parent.mkdir(parents=True)
+            with open(p, 'w+') as file:
+                file.write(text)
+            return None
+
     file = PDBIO()
     file.set_structure(structure)
     
@@ -31,6 +57,116 @@ def save_pdb(structure: Structure, out: Union[str, Path, StringIO]) -> None:
         return None
 
 
+# Same as Bio.PDB.PDBIO, without segment id and charge; an ATOM record is
+# columns 1-30 (labels), 31-54 (coordinates) and 55-80 (occupancy, ...)
+_LABEL_FORMAT_STRING = '%s%5i %-4s %3s %s%4i%s   '
+_VALUE_FORMAT_STRING = '%6.2f%6.2f          %2s  \n'
+_TER_FORMAT_STRING = 'TER   %5i      %3s %s%4i%s' + ' ' * 54 + '\n'
+
+
+def _format_fixed(x, width=8, decimals=3):
+    '''
+    Vectorized "%8.3f" formatting, returns an (n, width) uint8 array of ASCII
+    characters or None if a value does not fit.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    v = np.round(x * 10**decimals).astype(np.int64)
+    a = np.abs(v)
+    integer, fraction = a // 10**decimals, a % 10**decimals
+
+    out = np.full((len(v), width), ord(' '), dtype=np.uint8)
+    for k in range(decimals):
+        out[:, width - 1 - k] = ord('0') + fraction // 10**k % 10
+    point = width - 1 - decimals
+    out[:, point] = ord('.')
+
+    # Integer part right-aligned before the point, then the sign
+    digits = np.maximum(1, np.floor(np.log10(np.maximum(integer, 1))).astype(np.int64) + 1)
+    # Like Python, small negative numbers are written as "-0.000"
+    negative = np.signbit(x)
+    if np.any(digits + negative > point):
+        return None
+    for k in range(point):
+        col = point - 1 - k
+        has = digits > k
+        out[has, col] = ord('0') + integer[has] // 10**k % 10
+    rows = np.flatnonzero(negative)
+    out[rows, point - 1 - digits[rows]] = ord('-')
+    return out
+
+
+def _format_labels(table: AtomTable):
+    '''
+    Columns of the ATOM records that do not depend on the coordinates, as
+    (n, 30) and (n, 27) byte arrays.
+    '''
+    assert len(table) <= 99999, 'Too many atoms for the PDB format'
+    assert table.res_ids.max(initial=0) <= 9999, 'Residue number exceeds PDB format limit'
+    assert all(len(i) == 1 for i in set(table.res_chains)), 'Chain ids must be one character'
+
+    ix = table.residue_index
+    names = [pdb_atom_name(n, e) for n, e in zip(
+        table.names.tolist(), table.elements.tolist())]
+    labels = zip(
+        np.where(table.res_hetero, 'HETATM', 'ATOM  ')[ix].tolist(),
+        range(1, len(table) + 1),
+        names,
+        table.res_names[ix].tolist(),
+        table.res_chains[ix].tolist(),
+        table.res_ids[ix].tolist(),
+        table.res_icodes[ix].tolist())
+    values = zip(
+        table.occupancies.astype(np.float64).tolist(),
+        table.bfactors.astype(np.float64).tolist(),
+        np.char.upper(table.elements).tolist())
+
+    left = ''.join(_LABEL_FORMAT_STRING % i for i in labels)
+    right = ''.join(_VALUE_FORMAT_STRING % i for i in values)
+    return (
+        np.frombuffer(left.encode(), dtype=np.uint8).reshape(-1, 30),
+        np.frombuffer(right.encode(), dtype=np.uint8).reshape(-1, 27))
+
+
+def format_pdb(table: AtomTable) -> str:
+    '''
+    PDB text of an AtomTable, written like PDBIO does (atoms renumbered from
+    1, one TER record after each chain, then END). Records are assembled as
+    one (atoms, 81) byte array from the label columns and the coordinates,
+    which are formatted all at once.
+
+    The text is cached on the table. Tables are not changed in place (a
+    transform returns a new table), so the cache is valid as long as the
+    table is.
+    '''
+    def fn():
+        left, right = table.cached('pdb_labels', lambda: _format_labels(table))
+        xyz = [_format_fixed(i) for i in table.coords.T]
+        if any(i is None for i in xyz):
+            # Coordinates outside the PDB format range, let Python widen them
+            middle = ''.join('%8.3f%8.3f%8.3f' % tuple(i) for i in table.coords.astype(np.float64).tolist())
+            middle = np.frombuffer(middle.encode(), dtype=np.uint8).reshape(len(table), -1)
+        else:
+            middle = np.concatenate(xyz, axis=1)
+        rows = np.concatenate([left, middle, right], axis=1)
+
+        # TER after the last atom of each run of a chain
+        chains = table.chains
+        last = np.flatnonzero(np.append(chains[1:] != chains[:-1], True))
+        ix = table.residue_index
+        blocks, start = [], 0
+        for i in last.tolist():
+            r = ix[i]
+            blocks.append(rows[start:i + 1].tobytes().decode())
+            blocks.append(_TER_FORMAT_STRING % (
+                i + 2, table.res_names[r], table.res_chains[r],
+                table.res_ids[r], table.res_icodes[r]))
+            start = i + 1
+        blocks.append('END   \n')
+        return ''.join(blocks)
+
+    return table.cached('pdb', fn)
+
+
 def load_conserved(fp, ref=None, metric=mean_pairwise_similarity):
     '''
     If no reference sequence name is provided, assume the first sequence is
@@ -69,7 +205,7 @@ def load_conserved(fp, ref=None, metric=mean_pairwise_similarity):
     return l
 
 
-def read_pdb(fp: Union[str, Path], name: str='x') -> Structure:
+def read_pdb(fp: Union[str, Path], name: str='x', fast: bool=False) -> Structure:
    '''
    # https://biopython.org/wiki/The_Biopython_Structural_Bioinformatics_FAQ
 
@@ -80,37 +216,458 @@ def read_pdb(fp: Union[str, Path], name: str='x') -> Structure:
            for residue in chain:
                for atom in residue:
                    print(atom)
+
+   fast .. read the atoms with read_atoms() and build the structure from the
+   resulting table, which is faster but keeps only the first model; by
+   default all models are read with the PDBParser
+
+   Files can be in PDB or mmCIF format (.cif, .mmcif), and gzip-compressed
+   (.gz), eg "AF-P0A910-F1-model_v4.cif.gz".
    '''
    fp = Path(fp)
-   assert fp.exists()
+   if not fp.exists():
+       raise FileNotFoundError(fp)
+   if fast:
+       return read_atoms(fp).to_structure(name)
+
    # https://biopython.org/wiki/The_Biopython_Structural_Bioinformatics_FAQ
-   pdb_parser = PDB.PDBParser(QUIET=True, PERMISSIVE=0)
-   structure = pdb_parser.get_structure(name, str(fp))
+   if structure_format(fp) == 'cif':
+       parser = PDB.MMCIFParser(QUIET=True)
+   else:
+       parser = PDB.PDBParser(QUIET=True, PERMISSIVE=0)
+   with open_structure(fp, 'rt') as file:
+       structure = parser.get_structure(name, file)
    return structure
 
 
-def load_bfactor_column(fp):
+def structure_format(fp: Union[str, Path]) -> str:
+    '''
+    "cif" for .cif and .mmcif files (optionally .gz), otherwise "pdb"
+    '''
+    suffixes = [i.lower() for i in Path(fp).suffixes]
+    if suffixes and suffixes[-1] == '.gz':
+        suffixes = suffixes[:-1]
+    if suffixes and suffixes[-1] in ('.cif', '.mmcif'):
+        return 'cif'
+    return 'pdb'
+
+
+def open_structure(fp: Union[str, Path], mode: str='rb'):
+    '''
+    Open a structure file, .gz files are decompressed while reading (no
+    temporary files).
+    '''
+    if Path(fp).suffix.lower() == '.gz':
+        return gzip.open(fp, mode)
+    return open(fp, mode)
+
+
+def _column(rows, start, stop):
+    '''
+    Fixed-width column of a (lines, 80) byte array as an array of strings,
+    eg columns 31-38 (x coordinate) are _column(rows, 30, 38).
+    '''
+    width = stop - start
+    return np.ascontiguousarray(rows[:, start:stop]).view(f'S{width}').ravel()
+
+
+def _to_float(column, default=0.):
+    '''
+    Optional numeric columns (occupancy, B-factor) can be blank.
+    '''
+    column = np.char.strip(column)
+    column[column == b''] = str(default).encode()
+    return column.astype(np.float32)
+
+
+def read_atoms(fp: Union[str, Path, BinaryIO], fmt: str=None, names: Iterable[str]=None) -> AtomTable:
+    '''
+    Read the atoms of the first model in a structure file into an AtomTable.
+
+    fp .. path to a .pdb, .cif or .mmcif file, optionally gzip-compressed, or
+    a file object opened in binary mode (eg a member of a tar archive from
+    tarfile's .extractfile())
+    fmt .. "pdb" or "cif", inferred from the file name if not given
+    names .. only read atoms with these names, eg ['CA'] for alpha carbons;
+    other records are skipped before any of their fields are parsed
+
+    with tarfile.open('proteome.tar') as tar:
+        for member in tar:
+            if member.name.endswith('.cif.gz'):
+                with gzip.open(tar.extractfile(member)) as file:
+                    table = read_atoms(file, 'cif')
+    '''
+    if hasattr(fp, 'read'):
+        handle = nullcontext(fp)
+        fmt = fmt or 'pdb'
+    else:
+        handle = open_structure(fp, 'rb')
+        fmt = fmt or structure_format(fp)
+
+    with handle as file:
+        if fmt == 'pdb':
+            return _read_pdb_atoms(file, names)
+        elif fmt == 'cif':
+            return _read_cif_atoms(file, names)
+        else:
+            raise ValueError('Format not supported')
+
+
+def _read_pdb_atoms(file, names=None) -> AtomTable:
     '''
-    Load annotation data stored in the bfactor column of a .pdb file
+    Read the ATOM and HETATM records of a .pdb file. Each field of the PDB
+    format sits in fixed columns, so we read the records into one (lines, 80)
+    byte array and slice out all values of a field at once, instead of
+    creating one Python object per atom like the PDBParser.
+
+    https://www.wwpdb.org/documentation/file-format-content/format33/sect9.html
+
+    For alternate locations, only the first one (usually "A") is kept.
     '''
-    parser = PDBParser()
-    structure = parser.get_structure('', fp)
-    d = {}
+    if names is not None:
+        names = {i.encode() for i in names}
 
-    for res in structure.get_residues():
-        for atom in res:
-            # ALA > Ala
-            x = atom.parent.resname[0] + atom.parent.resname[1:].lower()  
-            try:
-                aa = SeqUtils.IUPACData.protein_letters_3to1[x]  
-                # same value for all atoms in a resudue
-            except KeyError:
+    records = []
+    for line in file:
+        if line.startswith((b'ATOM  ', b'HETATM')):
+            if names is not None and line[12:16].strip() not in names:
                 continue
+            records.append(line.rstrip(b'\r\n'))
+        elif line.startswith(b'ENDMDL'):
+            break
+    assert records, 'No ATOM or HETATM records found'
 
-            num = atom.full_id[3][1]
-            d[num] = [atom.bfactor, aa]
-    
-    return [i for i, j in d.values()]
+    # Lines are padded with null bytes (or truncated) to 80 columns
+    rows = np.array(records, dtype='S80').view(np.uint8).reshape(-1, 80)
+    # Null padding > spaces, so blank fields look the same on short lines
+    rows = np.where(rows == 0, ord(' '), rows).astype(np.uint8)
+
+    altlocs = _column(rows, 16, 17)
+    alt = altlocs[altlocs != b' ']
+    if len(alt):
+        keep = (altlocs == b' ') | (altlocs == alt[0])
+        rows = rows[keep]
+
+    # A new residue starts where resname, chain, resseq or icode change
+    # (columns 18-27)
+    key = rows[:, 17:27]
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = np.any(key[1:] != key[:-1], axis=1)
+    residue_index = np.cumsum(new) - 1
+    first = np.flatnonzero(new)
+
+    names = np.char.strip(_column(rows, 12, 16)).astype('U4')
+    elements = np.char.strip(_column(rows, 76, 78)).astype('U2')
+    # Element column is optional, fall back to the first letter of the name
+    missing = elements == ''
+    if missing.any():
+        elements[missing] = [
+            next((c for c in i if c.isalpha()), '') for i in names[missing]]
+
+    coords = np.stack([
+        _column(rows, 30, 38).astype(np.float32),
+        _column(rows, 38, 46).astype(np.float32),
+        _column(rows, 46, 54).astype(np.float32),
+        ], axis=1)
+
+    return AtomTable(
+        coords=coords,
+        names=names,
+        elements=elements,
+        bfactors=_to_float(_column(rows, 60, 66)),
+        residue_index=residue_index,
+        res_names=np.char.strip(_column(rows, 17, 20)[first]).astype('U3'),
+        res_ids=_column(rows, 22, 26)[first].astype(np.int64),
+        res_chains=_column(rows, 21, 22)[first].astype('U1'),
+        res_hetero=_column(rows, 0, 6)[first] == b'HETATM',
+        res_icodes=_column(rows, 26, 27)[first].astype('U1'),
+        occupancies=_to_float(_column(rows, 54, 60), 1.),
+        serials=_column(rows, 6, 11).astype(np.int64),
+        )
+
+
+# A CIF value is a bare word or quoted; a quote only closes a value if it is
+# followed by whitespace, so "O5'" can be written as 'O5''
+_CIF_TOKEN = re.compile(rb"""'(?:[^']|'(?!\s))*'(?=\s|$)|"(?:[^"]|"(?!\s))*"(?=\s|$)|\S+""")
+
+
+def _unquote(values):
+    quoted = np.char.startswith(values, b"'") | np.char.startswith(values, b'"')
+    if quoted.any():
+        values = values.copy()
+        values[quoted] = [i[1:-1] for i in values[quoted]]
+    return values
+
+
+def _read_cif_atoms(file, names=None) -> AtomTable:
+    '''
+    Read the _atom_site loop of an mmCIF file. Values of a loop are listed
+    row by row, so the tokens of all rows are one (atoms, fields) array and
+    each field is a column of it. Author-provided chain ids, residue numbers
+    and names are used if present, like Bio.PDB.MMCIFParser does.
+
+    https://mmcif.wwpdb.org/dictionaries/mmcif_pdbx_v50.dic/Categories/atom_site.html
+    '''
+    fields, lines = [], []
+    in_loop = False
+    for line in file:
+        line = line.strip()
+        if line.startswith(b'_atom_site.'):
+            in_loop = True
+            fields.append(line.split(b'.', 1)[1].decode().strip())
+        elif in_loop and fields:
+            if not line:
+                continue
+            if line.startswith((b'#', b'loop_', b'_', b'data_')):
+                break
+            lines.append(line)
+        elif line.startswith(b'loop_'):
+            # A loop with a different category resets the search
+            in_loop, fields = False, []
+    assert fields, 'No _atom_site records found'
+
+    block = b' '.join(lines)
+    if b"'" in block or b'"' in block:
+        tokens = _CIF_TOKEN.findall(block)
+    else:
+        tokens = block.split()
+    table = np.array(tokens, dtype=bytes).reshape(-1, len(fields))
+
+    def column(*names):
+        for name in names:
+            if name in fields:
+                return table[:, fields.index(name)]
+        raise KeyError(names[0])
+
+    def optional(name, default):
+        try:
+            values = column(name)
+        except KeyError:
+            return np.full(len(table), default)
+        values = _unquote(values)
+        values[np.isin(values, [b'.', b'?'])] = default
+        return values
+
+    # First model only
+    if 'pdbx_PDB_model_num' in fields:
+        models = column('pdbx_PDB_model_num')
+        table = table[models == models[0]]
+
+    atom_names = _unquote(column('auth_atom_id', 'label_atom_id'))
+    if names is not None:
+        keep = np.isin(atom_names, [i.encode() for i in names])
+        table, atom_names = table[keep], atom_names[keep]
+    assert len(table), 'No _atom_site records found'
+
+    altlocs = optional('label_alt_id', b' ')
+    alt = altlocs[altlocs != b' ']
+    if len(alt):
+        keep = (altlocs == b' ') | (altlocs == alt[0])
+        table, atom_names = table[keep], atom_names[keep]
+
+    chains = _unquote(column('auth_asym_id', 'label_asym_id'))
+    res_ids = column('auth_seq_id', 'label_seq_id')
+    res_names = _unquote(column('auth_comp_id', 'label_comp_id'))
+    icodes = optional('pdbx_PDB_ins_code', b' ')
+
+    # A new residue starts where chain, number, insertion code or name change
+    new = np.ones(len(table), dtype=bool)
+    for i in [chains, res_ids, icodes, res_names]:
+        new[1:] &= i[1:] == i[:-1]
+    new = ~new
+    new[0] = True
+    residue_index = np.cumsum(new) - 1
+    first = np.flatnonzero(new)
+
+    coords = np.stack([column(f'Cartn_{i}').astype(np.float32) for i in 'xyz'], axis=1)
+
+    return AtomTable(
+        coords=coords,
+        names=atom_names.astype('U4'),
+        elements=np.char.upper(_unquote(column('type_symbol'))).astype('U2'),
+        bfactors=optional('B_iso_or_equiv', b'0').astype(np.float32),
+        residue_index=residue_index,
+        res_names=res_names[first].astype('U3'),
+        res_ids=res_ids[first].astype(np.int64),
+        res_chains=chains[first].astype('U4'),
+        res_hetero=column('group_PDB')[first] == b'HETATM',
+        res_icodes=icodes[first].astype('U1'),
+        occupancies=optional('occupancy', b'1').astype(np.float32),
+        serials=column('id').astype(np.int64),
+        )
+
+
+# ------------------------------------------------------------------------------
+# Parse cache
+
+# Increment when the AtomTable columns or the reader change
+CACHE_VERSION = 1
+
+
+def get_cache_dir() -> Path:
+    '''
+    Set the FOLDVIS_CACHE environment variable to change the location.
+    '''
+    default = Path.home() / '.cache' / 'foldvis'
+    return Path(os.environ.get('FOLDVIS_CACHE', default))
+
+
+def hash_file(fp: Union[str, Path]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(fp, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_entry(fp: Path) -> Path:
+    key = hashlib.blake2b(str(fp).encode(), digest_size=16).hexdigest()
+    return get_cache_dir() / 'atoms' / key
+
+
+def read_cached_atoms(fp: Union[str, Path]) -> Union[AtomTable, None]:
+    '''
+    Return the cached AtomTable of a file, or None if there is no valid entry.
+
+    Entries are keyed on the resolved path and store size, mtime and content
+    hash of the file. If size and mtime match, the file is not read at all.
+    If not, the content hash decides, so eg a copied or touched file is not
+    parsed again. Arrays are memory-mapped (read-only) from the .npy files.
+    A cache that cannot be read (eg FOLDVIS_CACHE is not a directory) counts
+    as no entry.
+    '''
+    fp = Path(fp).resolve()
+    entry = _cache_entry(fp)
+    try:
+        with open(entry / 'meta.json', 'r') as file:
+            meta = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if meta['version'] != CACHE_VERSION:
+        return None
+
+    stat = fp.stat()
+    if (meta['size'], meta['mtime']) != (stat.st_size, stat.st_mtime_ns):
+        if meta['size'] != stat.st_size or meta['hash'] != hash_file(fp):
+            return None
+        # Same content, only the timestamp changed
+        meta['mtime'] = stat.st_mtime_ns
+        try:
+            _write_meta(entry, meta)
+        except OSError:
+            pass
+
+    try:
+        arrays = {k: np.load(entry / f'{k}.npy', mmap_mode='r') for k in COLUMNS}
+    except (OSError, ValueError):
+        return None
+    return AtomTable(**arrays)
+
+
+def _write_meta(entry, meta):
+    tmp = entry / 'meta.json.tmp'
+    with open(tmp, 'w+') as out:
+        json.dump(meta, out)
+    os.replace(tmp, entry / 'meta.json')
+
+
+def write_cached_atoms(fp: Union[str, Path], table: AtomTable) -> Path:
+    '''
+    Store the arrays of a table as .npy files next to some metadata. Entries
+    are written to a temporary directory first and then moved into place, so
+    concurrent readers never see a half-written entry.
+    '''
+    fp = Path(fp).resolve()
+    entry = _cache_entry(fp)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+
+    stat = fp.stat()
+    meta = {
+        'version': CACHE_VERSION,
+        'path': str(fp),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': hash_file(fp),
+        'sequence': table.sequence(),
+        'n_atoms': len(table),
+        'n_residues': table.n_residues,
+    }
+
+    tmp = Path(tempfile.mkdtemp(dir=entry.parent))
+    try:
+        for k, v in table.arrays().items():
+            np.save(tmp / f'{k}.npy', np.ascontiguousarray(v))
+        _write_meta(tmp, meta)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another process wrote the same entry in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+
+def load_atoms(fp: Union[str, Path], cache: bool=True, names: Iterable[str]=None) -> AtomTable:
+    '''
+    Read the atoms of a structure file, and reuse the parse cache if possible.
+
+    table = load_atoms('model.pdb')  # parses and writes the cache
+    table = load_atoms('model.pdb')  # memory-maps the cached arrays
+
+    names .. only atoms with these names, see read_atoms(). The cache holds
+    all atoms, so a reduced table is taken from a cached entry if there is
+    one, but is not written to the cache.
+
+    The cache is an optimization only: if it cannot be read or written (eg a
+    read-only or invalid FOLDVIS_CACHE) the file is parsed as usual.
+    '''
+    if cache:
+        table = read_cached_atoms(fp)
+        if table is not None:
+            if names is not None:
+                table = table.subset(table.select(*names, residues=np.ones(table.n_residues, dtype=bool)))
+            return table
+
+    table = read_atoms(fp, names=names)
+    if cache and names is None:
+        try:
+            write_cached_atoms(fp, table)
+        except OSError:
+            pass
+    return table
+
+
+def clear_cache() -> None:
+    '''
+    Remove parsed atoms and 3Di strings (see geometry.get_3di_states()).
+    '''
+    for i in ('atoms', '3di'):
+        shutil.rmtree(get_cache_dir() / i, ignore_errors=True)
+    return None
+
+
+def load_bfactor_column(fp, how='first', cache=True):
+    '''
+    Load annotation data stored in the bfactor column of a .pdb file, one
+    value per amino acid, eg the pLDDT of AlphaFold models.
+
+    how .. how to reduce the values of the atoms in a residue
+
+    - first, mean, min, max
+    - ca .. value of the alpha carbon, only these records are read, which is
+    the fastest way to get the pLDDT (same for all atoms of a residue)
+    '''
+    if how == 'ca':
+        table = load_atoms(fp, cache, names=['CA'])
+        how = 'first'
+    else:
+        table = load_atoms(fp, cache)
+    return table.per_residue(table.bfactors, how)[table.is_aa].tolist()
 
 
 def parse_hyphy(fp, method='meme', direction='positive', skip=[]):
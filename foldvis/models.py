@@ -1,44 +1,190 @@
 from collections import defaultdict, Counter
-from copy import deepcopy
-import io
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from copy import copy
+from glob import glob
 import json
+import os
 from pathlib import Path
 import re
-from typing import Union
+from typing import Iterable, Union
 
-from Bio import SeqIO
 from Bio.PDB.Structure import Structure
 import numpy as np
 import pandas as pd
 
-from foldvis.io import read_pdb, save_pdb
+from foldvis.atoms import AtomTable
+from foldvis.geometry import (
+    contact_map, distance_matrix, get_alpha_carbon_coords,
+    solvent_accessibility, superimpose)
+from foldvis.io import format_pdb, load_atoms, read_atoms, save_pdb
 from foldvis.parsers import HMMERStandardOutput
-from foldvis.utils import align_structures, search_domains, filter_aa
+from foldvis.utils import align_many, align_structures, search_domains
 
 
-class Complex():
+def _edit(table: AtomTable, kind, *args) -> AtomTable:
+    '''
+    Edits to a model are stored as tuples (not functions), so they can be
+    pickled along with it and replayed on atoms that are loaded later.
+    '''
+    if kind == 'transform':
+        rot, tra = args
+        # Same as Bio.PDB's .transform(), coord @ rot + tra
+        return table.replace(coords=table.coords @ rot + tra)
+    elif kind == 'rename':
+        renames, = args
+        chains = table.res_chains.copy()
+        for old, new in renames.items():
+            if new:
+                chains[table.res_chains == old] = new
+        return table.replace(res_chains=chains)
+    else:
+        raise ValueError('Edit not implemented')
+
+
+class Molecule():
+    '''
+    Shared by Fold and Complex. The atoms are held in an AtomTable, the
+    Bio.PDB structure is only built from it when first accessed. Changes to
+    the structure object are not written back to the atom table, so use the
+    methods of Fold and Complex (or replace .atoms) to modify a model.
+
+    Atoms are loaded lazily: .atoms reads all atoms and .ca_atoms only the
+    alpha carbons, whichever is accessed first. Edits made before all atoms
+    are loaded (eg alignment, chain renames) are replayed on them.
+    '''
+    _atoms = None
+    _ca_atoms = None
+    _structure = None
+    _edits = ()
+    cache = True
+
+    @property
+    def atoms(self) -> AtomTable:
+        if self._atoms is None:
+            table = load_atoms(self.path, self.cache)
+            for edit in self._edits:
+                table = _edit(table, *edit)
+            self.atoms = table
+        return self._atoms
+
+    @atoms.setter
+    def atoms(self, table: AtomTable):
+        self._atoms = table
+        self._ca_atoms = None
+        self._structure = None
+        self._edits = ()
+
+    @property
+    def ca_atoms(self) -> AtomTable:
+        '''
+        Only the atoms named "CA"; taken from .atoms if loaded, otherwise
+        only these records are read from the file.
+        '''
+        if self._ca_atoms is None:
+            if self._atoms is not None:
+                table = self._atoms.subset(self._atoms.alpha_carbons())
+            else:
+                table = load_atoms(self.path, self.cache, names=['CA'])
+                for edit in self._edits:
+                    table = _edit(table, *edit)
+            self._ca_atoms = table
+        return self._ca_atoms
+
+    def _edit_(self, kind, *args):
+        if self._atoms is not None:
+            self.atoms = _edit(self._atoms, kind, *args)
+        else:
+            self._edits = self._edits + ((kind, *args),)
+            if self._ca_atoms is not None:
+                self._ca_atoms = _edit(self._ca_atoms, kind, *args)
+        return None
+
+    def transform(self, rot, tra):
+        '''
+        Rotated and translated copy, coord @ rot + tra like Bio.PDB's
+        .transform(). The copy shares the labels (and annotation values) with
+        this model, only the coordinates are new, computed with one matrix
+        multiply over all atoms.
+        '''
+        cp = copy(self)
+        cp.annotation = dict(self.annotation)
+        cp._edit_('transform', rot, tra)
+        return cp
+
+    @property
+    def structure(self) -> Structure:
+        if self._structure is None:
+            self._structure = self.atoms.to_structure()
+        return self._structure
+
+    def add_bfactor(self, key='plddt', how='ca'):
+        '''
+        Annotate residues with the bfactor column, eg the pLDDT scores that
+        AlphaFold DB models store there.
+
+        how .. like foldvis.io.load_bfactor_column()
+
+        - first, mean, min, max .. reduce the values of all atoms of a
+        residue, see AtomTable.per_residue(); loads all atoms
+        - ca .. value of the alpha carbon, only needs .ca_atoms, enough for
+        the pLDDT (same for all atoms of a residue)
+        '''
+        if how == 'ca':
+            table, how = self.ca_atoms, 'first'
+        else:
+            table = self.atoms
+        values = table.per_residue(table.bfactors, how)[table.is_aa]
+        self.annotate_(key, values.tolist())
+        return None
+
+    def add_solvent_accessibility(self, key='rsa', relative=True, **kwargs):
+        '''
+        Annotate residues with their (relative) solvent accessible surface
+        area, see foldvis.geometry.solvent_accessibility()
+
+        fold.add_solvent_accessibility()
+        fold.annotation['rsa']
+        # [1.04, 0.72, 0.48, ...
+        '''
+        values = solvent_accessibility(self, relative, **kwargs)
+        self.annotate_(key, values.tolist())
+        return None
+
+    def distance_matrix(self, representation='alpha_carbons', **kwargs):
+        '''
+        Residue distances, see foldvis.geometry.distance_matrix()
+
+        fold.distance_matrix('heavy', output='sparse', cutoff=5)
+        '''
+        return distance_matrix(self, representation, **kwargs)
+
+    def contact_map(self, angstrom=8, representation='beta_carbons', **kwargs):
+        '''
+        Residue contacts, see foldvis.geometry.contact_map()
+        '''
+        return contact_map(self, angstrom, representation, **kwargs)
+
+    def to_stream(self):
+        '''
+        PDB text, cached until the atoms change (see foldvis.io.format_pdb)
+        '''
+        return format_pdb(self.atoms)
+
+
+class Complex(Molecule):
     '''
     AF2 will predict complexes and name them chain A .. n
 
     TODO: A Complex object should be made up of two or more Fold objects
     '''
-    def __init__(self, fp, quiet=True):
+    def __init__(self, fp, quiet=True, cache=True):
         self.path = Path(fp)
-        self.structure = read_pdb(self.path)
-        self.chains = []
+        self.cache = cache
+        self.atoms = load_atoms(self.path, cache)
         self.annotation = {}
-        
-        for chain in next(iter(self.structure)):
-            # for model in structure, for chain in model, ...
-            self.chains.append(chain)
-
-        positions = []
-        for chain in self.chains:
-            print(chain)
-            aa = filter_aa(chain)
-            p = [i+1 for i in range(len(aa))]
-            positions.extend(p)
 
+        # Positions restart at 1 for each chain
+        positions = self.atoms.positions().tolist()
         self.len = len(positions)
         self.annotate_('position', positions)
         return None
@@ -54,27 +200,52 @@ class Complex():
         # return len(list(self.structure.get_residues()))
         return self.len
 
-    def to_stream(self):
-        stream = io.StringIO()
-        return save_pdb(self.structure, stream).getvalue()
+    @property
+    def chains(self):
+        # for model in structure, for chain in model, ...
+        return list(next(iter(self.structure)))
+
 
 
-class Fold():
-    def __init__(self, fp, quiet=True, annotate=True):
+class Fold(Molecule):
+    def __init__(self, fp, quiet=True, annotate=True, cache=True, load='all'):
+        '''
+        cache .. reuse the parsed atoms from the on-disk cache (see
+        foldvis.io.load_atoms), set the FOLDVIS_CACHE environment variable to
+        change its location
+
+        load .. what to read from the file now, the rest is read on first
+        access of .atoms or .ca_atoms
+
+        - all .. all atoms
+        - ca .. only alpha carbons, enough for eg find_hotspots() or cluster()
+        - sequence .. only the sequence, eg for search_domains()
+        '''
         self.path = Path(fp)
+        self.cache = cache
+        self.load = load
 
         if not quiet:
             print(f'Loading structure in {self.path.name}')
-        self.sequence = self.read_sequence(self.path)
-        self.structure = read_pdb(self.path)
+        # One pass over the file gives atoms, sequence and positions
+        if load == 'all':
+            table = self.atoms
+        elif load in ('ca', 'sequence'):
+            table = self.ca_atoms
+        else:
+            raise ValueError('Load mode not supported')
+
+        self.sequence = self.read_sequence(table)
         self.transformed = False
         self.annotation = {}
 
         # 'ARNDCQEGHILKMFPSTWYV'
-        # SeqUtils.IUPACData.protein_letters_3to1[x]
         if annotate:
-            aa = filter_aa(self.structure)
-            self.annotate_('position', [i+1 for i in range(len(aa))])
+            n = int(table.is_aa.sum())
+            self.annotate_('position', [i+1 for i in range(n)])
+
+        if load == 'sequence':
+            self._ca_atoms = None
         # ln = len(list(self.structure.get_residues()))
         # self.annotate_('position', [i+1 for i in range(ln)])
         return None
@@ -85,15 +256,19 @@ class Fold():
     def __iter__(self):
         yield from self.structure
 
-    def read_sequence(self, fp: Union[str, Path]):
+    def read_sequence(self, x: Union[str, Path, AtomTable]):
+        '''
+        Amino acid sequence from the atom records (like SeqIO's "pdb-atom"
+        format, but without filling gaps in the residue numbering with "X").
+        Pass a path or an already loaded AtomTable to avoid reading the file
+        again.
+        '''
         # https://www.biostars.org/p/435629/
-        with open(fp, 'r') as file:
-            l = []
-            for record in SeqIO.parse(file, 'pdb-atom'):
-                l.append(record.seq)
-            if len(l) > 1:
-                print('Warning: More than one sequence found, returning first')
-            return l[0].__str__()
+        atoms = x if isinstance(x, AtomTable) else read_atoms(x)
+        chains = sorted(set(atoms.res_chains[atoms.is_aa]))
+        if len(chains) > 1:
+            print('Warning: More than one sequence found, returning first')
+        return atoms.sequence(chains[0])
 
     def __len__(self):
         '''Number of amino acids in the sequence'''
@@ -101,26 +276,48 @@ class Fold():
         return len(self.sequence)
 
     def align_to(self, ref, mode=0, minscore=0.5):
-        tmscore, rot, tra = align_structures(ref.path, self.path, mode=mode, minscore=minscore)
-        cp = deepcopy(self)
-        cp.structure.transform(rot, tra)
+        '''
+        Transformed copy of this fold superimposed onto <ref>, and the
+        TM-score of the alignment.
+
+        Models of the same sequence (eg the 5 models AlphaFold predicts) are
+        superimposed in-process on their alpha carbons, see
+        foldvis.geometry.superimpose(). Otherwise foldseek aligns the two
+        structures, see foldvis.utils.align_structures() for <mode> and
+        <minscore>.
+        '''
+        if self.corresponds_to(ref):
+            tmscore, _, rot, tra = superimpose(
+                get_alpha_carbon_coords(self), get_alpha_carbon_coords(ref))
+            tmscore = round(tmscore, 4)
+        else:
+            tmscore, rot, tra = align_structures(ref.path, self.path, mode=mode, minscore=minscore)
+        cp = self.transform(rot, tra)
         cp.transformed = True
         return tmscore, cp
 
+    def corresponds_to(self, ref) -> bool:
+        '''
+        True if the residues of both folds correspond one to one (same
+        sequence, one alpha carbon each), so they can be superimposed without
+        a structural alignment.
+        '''
+        return (self.sequence == ref.sequence and
+            len(self.ca_atoms.alpha_carbons()) == len(ref.ca_atoms.alpha_carbons()))
+
     def rename_chains_(self, renames: dict) -> None:
         '''
         - https://stackoverflow.com/questions/70246451/how-do-i-change-the-chain-name-of-a-pdb-file
         - modifies in place, "_" suffix convention like in pytorch
         '''
-        for model in self.structure:
-            for chain in model:
-                old_name = chain.get_id()
-                new_name = renames.get(old_name)
-                if new_name:
-                    print(f'Renaming chain {old_name} to {new_name}')
-                    chain.id = new_name
-                else:
-                    print(f'Keeping chain name {old_name}, no new name found')
+        table = self._atoms if self._atoms is not None else self.ca_atoms
+        for old_name in dict.fromkeys(table.res_chains):
+            new_name = renames.get(old_name)
+            if new_name:
+                print(f'Renaming chain {old_name} to {new_name}')
+            else:
+                print(f'Keeping chain name {old_name}, no new name found')
+        self._edit_('rename', renames)
         return None
 
     def add_scores(self, fp):
@@ -129,9 +326,6 @@ class Fold():
             self.annotate_('plddt', scores['plddt'])
         return None
 
-    def to_stream(self):
-        stream = io.StringIO()
-        return save_pdb(self.structure, stream).getvalue()
 
     def annotate_(self, key, values, check=True):
         if check:
@@ -140,25 +334,160 @@ class Fold():
         return None
 
 
+def _load_folds(paths, kwargs):
+    '''
+    Worker for FoldCollection, errors are returned instead of raised so one
+    broken file does not take down the whole chunk.
+    '''
+    results = []
+    for fp in paths:
+        try:
+            results.append((Fold(fp, **kwargs), None))
+        except Exception as err:
+            results.append((None, f'{type(err).__name__}: {err}'))
+    return results
+
+
+class FoldCollection():
+    '''
+    Load many structures in parallel.
+
+    folds = FoldCollection('predictions/', pattern='*.pdb', workers=8)
+    folds = FoldCollection('proteome/*.cif.gz')
+    folds = FoldCollection([fp1, fp2, ...])
+
+    len(folds)
+    folds[0]  # Fold
+    for fold in folds: ...
+    folds.failed  # {path: error message}
+
+    Files are sent to a process pool in chunks of <chunksize> files, and at
+    most 2 chunks per worker are pending at any time, so only loaded folds
+    accumulate in memory, not the queue. Folds are in the same order as the
+    (sorted) paths, no matter which worker finished first. Files that cannot
+    be loaded are skipped and listed in .failed.
+
+    workers .. number of processes, defaults to the number of CPUs; 1 loads
+    in this process
+    kwargs .. passed to Fold, eg cache=False
+    '''
+    def __init__(self, source: Union[str, Path, Iterable], pattern='*.pdb', workers=None, chunksize=16, quiet=True, **kwargs):
+        self.paths = self.find(source, pattern)
+        self.failed = {}
+        
+        workers = workers or os.cpu_count() or 1
+        chunks = [self.paths[i:i + chunksize] for i in range(0, len(self.paths), chunksize)]
+        results = [None] * len(chunks)
+
+        if workers == 1:
+            for n, chunk in enumerate(chunks):
+                results[n] = _load_folds(chunk, kwargs)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = {}
+                todo = iter(enumerate(chunks))
+
+                for n, chunk in todo:
+                    pending[executor.submit(_load_folds, chunk, kwargs)] = n
+                    if len(pending) >= 2 * workers:
+                        break
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                        # Refill the queue as chunks finish
+                        for n, chunk in todo:
+                            pending[executor.submit(_load_folds, chunk, kwargs)] = n
+                            break
+
+        self.folds = []
+        for fp, (fold, err) in zip(self.paths, (i for chunk in results for i in chunk)):
+            if err:
+                self.failed[fp] = err
+            else:
+                self.folds.append(fold)
+
+        if not quiet:
+            print(f'Loaded {len(self.folds)} structures, {len(self.failed)} failed')
+        return None
+
+    @staticmethod
+    def find(source, pattern='*.pdb'):
+        '''
+        Paths from a directory (matching <pattern>), a glob expression or a
+        list of paths; directory and glob results are sorted.
+        '''
+        if isinstance(source, (str, Path)):
+            if Path(source).is_dir():
+                return sorted(Path(source).glob(pattern))
+            return [Path(i) for i in sorted(glob(str(source), recursive=True))]
+        return [Path(i) for i in source]
+
+    def align_to(self, ref, mode=0, minscore=0.5):
+        '''
+        TM-scores and transformed copies of all folds superimposed onto
+        <ref>, like Fold.align_to(). Folds with the sequence of <ref> are
+        superimposed in-process, all others in one batched foldseek run (see
+        foldvis.utils.align_many()). Folds that foldseek cannot align above
+        <minscore> have a TM-score of NaN and are not transformed.
+        '''
+        tmscores = np.full(len(self), np.nan)
+        aligned = list(self.folds)
+
+        rest = []
+        for i, fold in enumerate(self.folds):
+            if fold.corresponds_to(ref):
+                tmscores[i], aligned[i] = fold.align_to(ref)
+            else:
+                rest.append(i)
+
+        if rest:
+            scores, rotations, translations = align_many(
+                ref, [self.folds[i] for i in rest], mode, minscore)
+            for i, score, rot, tra in zip(rest, scores, rotations, translations):
+                if np.isnan(score):
+                    continue
+                tmscores[i] = score
+                aligned[i] = self.folds[i].transform(rot, tra)
+                aligned[i].transformed = True
+
+        return tmscores, aligned
+
+    def __repr__(self):
+        return f'FoldCollection of {len(self)} structures'
+
+    def __len__(self):
+        return len(self.folds)
+
+    def __getitem__(self, i):
+        return self.folds[i]
+
+    def __iter__(self):
+        yield from self.folds
+
+
 class AlphaFold():
     '''
     fold = AlphaFold(...)
     fold.best -> structure, wrapped in Fold object (keeps track of filepath ...)
     '''
-    def __init__(self, indir, workdir=None):
+    def __init__(self, indir, workdir=None, cache=True):
         self.models = {}
         self.workdir = workdir
 
-        for n, i in enumerate(self.read_alphafold(indir, workdir)):
+        for n, i in enumerate(self.read_alphafold(indir, workdir, cache)):
             self.models[n+1] = i
         
         return None
 
 
-    def read_alphafold(self, filedir, outdir=None):
+    def read_alphafold(self, filedir, outdir=None, cache=True):
         '''
         Load structures and (quality) scores, align them, and put prepare data
         for visualization.
+
+        cache .. reuse parsed structures, see foldvis.io.load_atoms
         '''
         files = Path(filedir).glob('*.pdb')
         d = {}
@@ -173,7 +502,7 @@ class AlphaFold():
             with open(fp, 'r') as file:
                 scores = json.load(file)
            
-            fold = Fold(i)
+            fold = Fold(i, cache=cache)
             fold.annotate_('plddt', scores['plddt'])
     
             v = np.mean(scores['plddt'])
@@ -198,11 +527,11 @@ class AlphaFold():
                 outdir.mkdir(parents=True)
     
             name = ref.path.name.replace('.pdb', '.reference.pdb')
-            _ = save_pdb(ref.structure, outdir / name)
+            _ = save_pdb(ref.atoms, outdir / name)
     
             for qry in rest:
                 name = qry.path.name.replace('.pdb', '.transform.pdb')
-                _ = save_pdb(qry.structure, outdir / name)
+                _ = save_pdb(qry.atoms, outdir / name)
     
         return [ref] + rest
 
@@ -1,20 +1,335 @@
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+import hashlib
+import json
+from multiprocessing import shared_memory
+import os
+from pathlib import Path
+import time
 from typing import Literal
 
 from hdbscan import HDBSCAN
 import numpy as np
 
 from esda import fdr
-from esda.getisord import G_Local
-from esda.moran import Moran_Local
-from libpysal.weights import DistanceBand
+from scipy.sparse import csr_matrix, identity
+from scipy.stats import norm
 
-from foldvis.geometry import get_alpha_carbon_atoms 
+from foldvis.geometry import get_residue_coordinates, neighbors_within, points_within, residue_table
 
 
 # ------------------------------------------------------------------------------
 # Spatial autocorrelation
 
-def find_hotspots(model, features, method: Literal['getis_ord', 'moran'] = 'getis_ord', angstrom=8, false_discovery_rate=0.05, test_two_sided=False):
+def feature_matrix(fold, keys) -> np.ndarray:
+    '''
+    (residues, features) matrix of annotation tracks, eg
+
+    X = feature_matrix(fold, ['plddt', 'conservation', 'meme'])
+    '''
+    return np.column_stack([np.asarray(fold.annotation[k], dtype=np.float64) for k in keys])
+
+
+def distance_weights(points, angstrom=8, star=False) -> csr_matrix:
+    '''
+    Binary sparse spatial weights from an (n, 3) coordinate array, 1 for
+    points closer than <angstrom>. The same as spatial_weights() but without
+    a fold, eg in worker processes (see batch_hotspots()).
+    '''
+    W = points_within(points, angstrom).astype(np.float64)
+    if star:
+        W = (W + identity(W.shape[0], format='csr')).tocsr()
+    return W
+
+
+def spatial_weights(fold, angstrom=8, coordinates='alpha_carbons', star=False) -> csr_matrix:
+    '''
+    Binary sparse spatial weights, 1 for residues closer than <angstrom>,
+    from the cached neighbor matrix (see foldvis.geometry.neighbors_within()),
+    so they are built once per fold and distance. Same as libpysal's
+    DistanceBand(points, angstrom, binary=True) but without Python loops.
+
+    star .. include each residue in its own neighborhood (diagonal set)
+    '''
+    W = neighbors_within(fold, angstrom, coordinates).astype(np.float64)
+    if star:
+        W = (W + identity(W.shape[0], format='csr')).tocsr()
+    return W
+
+
+def local_statistic(X, W, method: Literal['getis_ord', 'moran'] = 'getis_ord') -> np.ndarray:
+    '''
+    Local statistic of all columns of the feature matrix <X> at once, with
+    binary weights <W> (see spatial_weights(), with star=True for G*). Same
+    as .Gs of esda's G_Local and .Is of Moran_Local with transform "B".
+
+    - getis_ord .. G*_i = sum_j w_ij x_j / sum_j x_j
+    - moran .. I_i = (n - 1) z_i sum_j w_ij z_j / sum_j z_j^2, z standardized
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    if method == 'getis_ord':
+        return (W @ X) / X.sum(axis=0)
+    elif method == 'moran':
+        Z = (X - X.mean(axis=0)) / X.std(axis=0)
+        return (len(Z) - 1) * Z * (W @ Z) / (Z ** 2).sum(axis=0)
+    else:
+        raise ValueError('Method not implemented')
+
+
+# Result of permutation_test(), each field is a (residues, features) array
+LocalTest = namedtuple('LocalTest', ['statistic', 'z_sim', 'p_z_sim', 'p_sim', 'permutations'])
+
+
+def _permutation_index(n, k, permutations, rng):
+    '''
+    (permutations, k) random indices, each row drawn without replacement from
+    range(n) in random order. Floyd's algorithm, vectorized over the rows:
+    k draws per row instead of n, so the cost does not grow with n.
+    '''
+    ids = np.empty((permutations, k), dtype=np.int64)
+    for col, j in enumerate(range(n - k, n)):
+        t = rng.integers(0, j + 1, size=permutations)
+        seen = (ids[:, :col] == t[:, None]).any(axis=1)
+        ids[:, col] = np.where(seen, j, t)
+    return rng.permuted(ids, axis=1)
+
+
+def _permute_sites(sites, values, lags, signs, indptr, weights, ids):
+    '''
+    Conditional randomization of the neighborhood sums (lags) at <sites>:
+    the value at each site stays, its neighbors are drawn from all other
+    sites. Row p of <ids> draws from range(n - 1); for site i, a drawn i
+    stands for site n - 1, which makes it a draw from all sites but i.
+
+    Returns, per site and feature, the sum and sum of squares of the permuted
+    lags and how many permuted statistics are at least as large as the
+    observed one (<signs> is the sign of the factor that turns a lag into
+    the statistic).
+
+    With binary weights, the permuted lags of all sites with c neighbors are
+    the same prefix sums of values[ids[:, :c]], except for the few draws of
+    the site itself, so no per-site gathering is needed.
+    '''
+    permutations = len(ids)
+    n, k = values.shape
+    cardinalities = np.diff(indptr)[sites]
+    total, squares, larger = (np.zeros((len(sites), k)) for _ in range(3))
+    # Correction of a lag for a draw of the site itself
+    delta = values[sites] - values[-1]
+
+    # Ties (common for discrete features) must not depend on the order in
+    # which a lag was summed up
+    tol = 1e-8 * np.abs(values).max(axis=0)
+
+    def count(lag, observed, sign):
+        # statistic >= observed, with the sign of the factor
+        return np.where(sign > 0, lag >= observed - tol, np.where(
+            sign < 0, lag <= observed + tol, True))
+
+    if np.all(weights == 1):
+        prefix = np.cumsum(values[ids], axis=1)
+        lookup = np.full(n, -1)
+        for c in np.unique(cardinalities):
+            group = np.flatnonzero(cardinalities == c)
+            base = prefix[:, c-1] if c else np.zeros((permutations, k))
+            ordered = np.sort(base, axis=0)
+            obs, sign = lags[sites[group]], signs[sites[group]]
+            total[group] = base.sum(axis=0)
+            squares[group] = (base ** 2).sum(axis=0)
+            for f in range(k):
+                ge = permutations - np.searchsorted(ordered[:, f], obs[:, f] - tol[f], 'left')
+                le = np.searchsorted(ordered[:, f], obs[:, f] + tol[f], 'right')
+                larger[group, f] = np.where(sign[:, f] > 0, ge, np.where(
+                    sign[:, f] < 0, le, permutations))
+
+            # Draws of the site itself among its first c neighbors
+            lookup[sites[group]] = np.arange(len(group))
+            p, m = np.nonzero(lookup[ids[:, :c]] >= 0)
+            m = lookup[ids[p, m]]
+            lookup[sites[group]] = -1
+            if len(p) == 0:
+                continue
+            g = group[m]
+            old, new = base[p], base[p] - delta[g]
+            np.add.at(total, g, new - old)
+            np.add.at(squares, g, new ** 2 - old ** 2)
+            np.add.at(larger, g,
+                count(new, lags[sites[g]], signs[sites[g]]).astype(float) -
+                count(old, lags[sites[g]], signs[sites[g]]))
+        return total, squares, larger
+
+    for j, i in enumerate(sites):
+        w = weights[indptr[i]:indptr[i+1]]
+        idx = ids[:, :len(w)]
+        idx = np.where(idx == i, n - 1, idx)
+        lag = np.einsum('pck,c->pk', values[idx], w)
+        total[j] = lag.sum(axis=0)
+        squares[j] = (lag ** 2).sum(axis=0)
+        larger[j] = count(lag, lags[i], signs[i]).sum(axis=0)
+    return total, squares, larger
+
+
+def _not_significant(larger, total, squares, done, lags, alpha, c):
+    '''
+    Sites (and features) whose p_sim and p_z_sim are both above <alpha> with
+    confidence, <c> is the one-sided normal quantile of the confidence level.
+    p_sim uses the Wilson score lower bound, p_z_sim the standard error of
+    the z-score estimated from <done> permutations.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.minimum(larger, done - larger) / done
+        lower = (p + c**2 / (2 * done) - c * np.sqrt(
+            p * (1 - p) / done + c**2 / (4 * done**2))) / (1 + c**2 / done)
+
+        mean = total / done
+        z = np.abs(lags - mean) / np.sqrt(np.maximum(squares / done - mean ** 2, 0))
+        upper = z + c * np.sqrt((1 + z**2 / 2) / done)
+    return (lower > alpha) & (upper < norm.isf(alpha))
+
+
+def permutation_test(X, W, method: Literal['getis_ord', 'moran'] = 'getis_ord', permutations=999, seed=None, n_jobs=1, sequential=False, alpha=0.05, confidence=0.999) -> LocalTest:
+    '''
+    X = feature_matrix(fold, ['plddt', 'meme'])
+    result = permutation_test(X, spatial_weights(fold, 8, star=True), seed=42)
+    result.p_z_sim
+    # array([[0.12, 0.43], ...
+
+    Local statistic (see local_statistic()) and its significance under
+    conditional randomization for all columns of <X>, like esda's G_Local
+    and Moran_Local: the permuted statistics give z_sim and p_z_sim (normal
+    approximation, one-sided) and p_sim (pseudo p-value, folded).
+
+    Each statistic is factor_i * (self_weight_i * x_i + lag_i), where only
+    the lag (sum of the neighbor values) is permuted. The random neighbor
+    draws are one (permutations, max. neighbors) index matrix generated from
+    <seed> and shared by all sites and features, as in esda. Sites are split
+    across <n_jobs> processes (None or -1 for all CPUs), but because the
+    draws are made up front, results do not depend on <n_jobs>.
+
+    sequential .. sequential Monte Carlo test (after Besag & Clifford, 1991):
+    permutations are drawn in blocks of doubling size, and a site (and
+    feature) stops once both its p-values (p_sim and p_z_sim) are above
+    <alpha> with the given <confidence>. Such a site cannot become
+    significant at level <alpha> (or under an FDR of <alpha>), so the budget
+    of <permutations> is spent on the others. Blocks are drawn the same way
+    without <sequential>, so both modes see the same permutations and only
+    the stopped sites differ. .permutations holds the number of permutations
+    per site and feature. This saves most with non-binary weights, where each
+    site is permuted on its own; with binary weights, sites with the same
+    number of neighbors share the work, so stopping some of them saves less.
+
+    "Sequential Monte Carlo p-values", Besag & Clifford, Biometrika, 1991
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    X = X.reshape(len(X), -1)
+    n = len(X)
+    observed = local_statistic(X, W, method)
+
+    if method == 'getis_ord':
+        values = X
+        factor = np.broadcast_to(1 / X.sum(axis=0), X.shape)
+    elif method == 'moran':
+        values = (X - X.mean(axis=0)) / X.std(axis=0)
+        factor = values * (n - 1) / (values ** 2).sum(axis=0)
+    else:
+        raise ValueError('Method not implemented')
+
+    # Self weights stay in place, only the other neighbors are permuted
+    W = csr_matrix(W, dtype=np.float64, copy=True)
+    W.setdiag(0)
+    W.eliminate_zeros()
+    lags = W @ values
+
+    rng = np.random.default_rng(seed)
+    k = min(max(int(np.diff(W.indptr).max()), 1), n - 1)
+    args = (values, lags, np.sign(factor), W.indptr, W.data)
+
+    # Blocks double in size, so sites that stop early cost little. Without
+    # <sequential>, the same blocks are drawn but permuted in one go.
+    blocks, size = [], 32
+    while sum(blocks) < permutations:
+        blocks.append(min(size, permutations - sum(blocks)))
+        size *= 2
+    rounds = [[i] for i in blocks] if sequential else [blocks]
+    c = norm.isf(1 - confidence)
+
+    total, squares, larger, done = (np.zeros((n, X.shape[1])) for _ in range(4))
+    active = np.ones((n, X.shape[1]), dtype=bool)
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    assert n_jobs >= 1, 'n_jobs must be positive, or None or -1 for all CPUs'
+    with ProcessPoolExecutor(n_jobs) if n_jobs != 1 else nullcontext() as executor:
+        for sizes in rounds:
+            sites = np.flatnonzero(active.any(axis=1))
+            if len(sites) == 0:
+                break
+            ids = np.concatenate([_permutation_index(n - 1, k, i, rng) for i in sizes])
+            size = len(ids)
+
+            if executor is None:
+                results = _permute_sites(sites, *args, ids)
+            else:
+                futures = [executor.submit(_permute_sites, i, *args, ids) for i in np.array_split(sites, n_jobs)]
+                results = (np.concatenate(i) for i in zip(*[f.result() for f in futures]))
+
+            keep = active[sites]
+            for x, y in zip((total, squares, larger), results):
+                x[sites] += np.where(keep, y, 0)
+            done[sites] += np.where(keep, size, 0)
+
+            if sequential:
+                active &= ~_not_significant(
+                    larger, total, squares, done, lags, alpha, c)
+
+    # Moments of the permuted statistics from those of the lags
+    mean = total / done
+    var = np.maximum(squares / done - mean ** 2, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_sim = (lags - mean) / np.sqrt(var)
+    z_sim = z_sim * np.sign(factor)
+    p_z_sim = norm.sf(np.abs(z_sim))
+
+    # Folded, ie the smaller of the two tails
+    larger = np.minimum(larger, done - larger)
+    p_sim = (larger + 1) / (done + 1)
+    return LocalTest(observed, z_sim, p_z_sim, p_sim, done.astype(np.int64))
+
+
+def hotspots(X, W, method: Literal['getis_ord', 'moran'] = 'getis_ord', false_discovery_rate=0.05, test_two_sided=False, permutations=999, seed=None, n_jobs=1, sequential=False, pvalue: Literal['z_sim', 'sim'] = 'z_sim') -> np.ndarray:
+    '''
+    (residues, features) 0/1 matrix of significant residues for a feature
+    matrix <X> and spatial weights <W> (with the diagonal set for G*), see
+    find_hotspots(), which builds the weights from a fold.
+    '''
+    X = np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+    # Stop permuting residues that cannot pass the FDR threshold
+    alpha = false_discovery_rate / 2 if test_two_sided else false_discovery_rate
+    local = permutation_test(
+        X, W, method, permutations, seed, n_jobs, sequential, alpha)
+
+    if pvalue == 'z_sim':
+        P = local.p_z_sim
+    elif pvalue == 'sim':
+        P = local.p_sim
+    else:
+        raise ValueError('Method not implemented')
+
+    if test_two_sided:
+        P = P * 2
+
+    result = []
+    for ps in P.T:
+        FDR = fdr(ps, false_discovery_rate)
+        # For Getis-Ord, we could use:
+        # ps = local.p_norm
+        # FDR = fdr(local.p_norm, false_discovery_rate)
+        # ... but the resulting FDR p-values seem near identical
+        result.append([1 if i < FDR else 0 for i in ps])
+    return np.array(result, dtype=np.int64).reshape(-1, len(X)).T
+
+
+def find_hotspots(model, features, method: Literal['getis_ord', 'moran'] = 'getis_ord', angstrom=8, false_discovery_rate=0.05, test_two_sided=False, coordinates='alpha_carbons', permutations=999, seed=None, n_jobs=1, sequential=False, pvalue: Literal['z_sim', 'sim'] = 'z_sim'):
     '''
     Getis-Ord statistic for spatial association.
 
@@ -31,31 +346,35 @@ def find_hotspots(model, features, method: Literal['getis_ord', 'moran'] = 'geti
     "p_z_sim" in:
 
     - https://squidpy.readthedocs.io/en/latest/_modules/squidpy/gr/_ppatterns.html
-    '''
-    ca = list(get_alpha_carbon_atoms(model, only_coords=True))
-    dist = DistanceBand(ca, angstrom, p=2, binary=True)
-    # <star> .. include the present observation, see Getis and Ord, 1992
-    
-    if method == 'getis_ord':
-        local = G_Local(features, dist, 'B', permutations=1000, star=True)
-    
-    elif method == 'moran':
-        local = Moran_Local(features, dist, 'B', permutations=1000)
 
-    else:
-        raise ValueError('Method not implemented')
+    Residues are points at their <coordinates>, eg side_chain, see
+    foldvis.geometry.get_residue_coordinates().
 
-    if not test_two_sided:
-        ps = local.p_z_sim
-    else:
-        ps = local.p_z_sim * 2
+    <features> is one value per residue, or a (residues, features) matrix
+    (see feature_matrix()) to test several tracks on the same spatial
+    weights, which are built once per fold. For a matrix, the result is a
+    matrix of the same shape.
+
+    hotspots = find_hotspots(fold, feature_matrix(fold, ['plddt', 'meme']))
+
+    P-values come from <permutations> conditional randomizations, which are
+    reproducible with a <seed> and can run on <n_jobs> processes, see
+    permutation_test(). The FDR is controlled on <pvalue>, z_sim (normal
+    approximation, p_z_sim) or sim (pseudo p-value, p_sim). With
+    <sequential>, residues stop being permuted once they clearly cannot pass
+    the FDR threshold, which saves time but leaves the result unchanged
+    (up to the confidence of the stopping rule).
+    '''
+    X = np.asarray(features, dtype=np.float64)
+    # <star> .. include the present observation, see Getis and Ord, 1992
+    W = spatial_weights(model, angstrom, coordinates, star=method == 'getis_ord')
+    result = hotspots(
+        X, W, method, false_discovery_rate, test_two_sided, permutations,
+        seed, n_jobs, sequential, pvalue)
 
-    FDR = fdr(ps, false_discovery_rate)
-    # For Getis-Ord, we could use:
-    # ps = local.p_norm
-    # FDR = fdr(local.p_norm, false_discovery_rate)
-    # ... but the resulting FDR p-values seem near identical
-    return [1 if i < FDR else 0 for i in ps]
+    if X.ndim == 1:
+        return result[:, 0].tolist()
+    return result
 
 
 # ------------------------------------------------------------------------------
@@ -64,20 +383,306 @@ def find_hotspots(model, features, method: Literal['getis_ord', 'moran'] = 'geti
 
 
 # TODO: MCL
-def cluster(fold, mask, *args, **kwargs):
+def cluster(fold, mask, *args, coordinates='alpha_carbons', **kwargs):
     '''
     from foldvis.stats import cluster
     from foldvis.geometry import get_alpha_carbon_atoms
 
     mask = [1 if i < 0.05 else 0 for i in d['meme']['positive']['scores']]
     cluster(model, mask, min_cluster_size=2)
+    cluster(model, mask, min_cluster_size=2, coordinates='side_chain')
     '''
-    points = list(get_alpha_carbon_atoms(fold, only_coords=True))
-    X = [i for i, j in zip(points, mask) if j]
+    points = get_residue_coordinates(fold, coordinates)
+    return cluster_points(points, mask, *args, **kwargs)
+
+
+def cluster_points(points, mask, *args, **kwargs):
+    '''
+    HDBSCAN labels of the (n, 3) <points> selected by <mask>, see cluster().
+    '''
+    X = points[np.asarray(mask, dtype=bool)]
     clusterer = HDBSCAN(*args, **kwargs)
     return clusterer.fit_predict(X)
 
 
+def _single_linkage(X, min_samples):
+    '''
+    Single linkage tree of the mutual reachability distances (core distances
+    and minimum spanning tree), the part of HDBSCAN that depends on
+    min_samples but not on min_cluster_size. Built like HDBSCAN() does with
+    its defaults for 3D points (algorithm "best", ie Boruvka on a KD-tree),
+    so labels match cluster().
+
+    Uses hdbscan internals, raises ImportError or TypeError if they change.
+    '''
+    from hdbscan.hdbscan_ import _hdbscan_boruvka_kdtree
+    return _hdbscan_boruvka_kdtree(
+        X, min_samples, alpha=1.0, metric='euclidean', p=None, leaf_size=40,
+        approx_min_span_tree=True, gen_min_span_tree=False,
+        core_dist_n_jobs=4)[0]
+
+
+def _tree_labels(X, tree, min_cluster_size, **kwargs):
+    '''
+    Flat HDBSCAN clustering from a single linkage tree, see _single_linkage().
+    '''
+    from hdbscan.hdbscan_ import _tree_to_labels
+    return _tree_to_labels(X, tree, min_cluster_size, **kwargs)[0]
+
+
+def cluster_sweep(fold, mask, min_cluster_sizes, min_samples=(5,), coordinates='alpha_carbons', **kwargs) -> dict:
+    '''
+    from foldvis.stats import cluster_sweep
+
+    labels = cluster_sweep(model, mask, range(2, 11), min_samples=[1, 2, 5])
+    labels[(3, 2)]  # min_cluster_size 3, min_samples 2
+    # array([ 0,  0, -1,  1, ...
+
+    HDBSCAN labels of the masked residues, the same as cluster(fold, mask,
+    min_cluster_size=m, min_samples=s), for all combinations of
+    <min_cluster_sizes> and <min_samples>. The expensive part, core
+    distances and minimum spanning tree, is computed once per min_samples
+    and cached for the fold and mask; each min_cluster_size only condenses
+    the resulting tree and selects clusters from it.
+
+    min_samples defaults to 5, which is what HDBSCAN uses for its default
+    min_cluster_size of 5. It has to be set: None (HDBSCAN's min_samples =
+    min_cluster_size) would need a new tree for every size.
+
+    Other arguments (eg cluster_selection_method, allow_single_cluster,
+    cluster_selection_epsilon) are the same as for HDBSCAN. If the hdbscan
+    internals this relies on change, each combination is fit from scratch.
+    '''
+    assert None not in min_samples, 'Set min_samples, None needs one tree per min_cluster_size'
+    mask = np.asarray(mask, dtype=bool)
+    table = residue_table(fold, coordinates)
+    X = get_residue_coordinates(fold, coordinates)[mask]
+    key = np.packbits(mask).tobytes()
+
+    result = {}
+    for ms in min_samples:
+        for mcs in min_cluster_sizes:
+            if len(X) < 2:
+                result[(mcs, ms)] = np.full(len(X), -1)
+                continue
+            # Same adjustments as hdbscan.hdbscan()
+            k = max(1, min(len(X) - 1, ms))
+            try:
+                tree = table.cached(
+                    ('single_linkage', coordinates, key, k),
+                    lambda: _single_linkage(X, k))
+                labels = _tree_labels(X, tree, mcs, **kwargs)
+            except (ImportError, TypeError):
+                labels = cluster_points(
+                    X, np.ones(len(X), dtype=bool), min_cluster_size=mcs,
+                    min_samples=ms, **kwargs)
+            result[(mcs, ms)] = labels
+    return result
+
+
+# ------------------------------------------------------------------------------
+# Batch processing
+
+def _share(array):
+    '''
+    Copy an array into a new shared memory block, returns the block and a
+    (name, shape, dtype) spec to attach to it from other processes.
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[:] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+# Shared memory blocks attached in this (worker) process, by name
+_ATTACHED = {}
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    if name not in _ATTACHED:
+        try:
+            # Python >= 3.13, the creating process owns the block
+            _ATTACHED[name] = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            _ATTACHED[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype, buffer=_ATTACHED[name].buf)
+
+
+def _shared_batch_job(coords, features, job, *params):
+    '''
+    _batch_job() in a worker process, which reads the coordinates and
+    features of a structure from shared memory.
+    '''
+    name, (a, b), (c, d), k = job
+    points = _attach(coords)[a:b]
+    X = _attach(features)[c:d].reshape(-1, k)
+    return _batch_job(name, points, X, *params)
+
+
+def _batch_job(name, points, X, method, angstrom, cluster_kwargs, kwargs):
+    '''
+    Hotspots (and their clusters) of one structure.
+    '''
+    start = time.perf_counter()
+    seed = kwargs.get('seed')
+    if seed is not None:
+        # Per structure, so results do not depend on the order of the jobs
+        key = int(hashlib.blake2b(name.encode(), digest_size=8).hexdigest(), 16)
+        kwargs = dict(kwargs, seed=[seed, key])
+
+    W = distance_weights(points, angstrom, star=method == 'getis_ord')
+    result = hotspots(X, W, method, **kwargs)
+    record = {
+        'name': name,
+        'residues': len(points),
+        'hotspots': result.T.tolist(),
+        }
+
+    if cluster_kwargs is not None:
+        record['clusters'] = []
+        for mask in result.T:
+            labels = np.full(len(points), -1)
+            if mask.sum() > 1:
+                labels[mask == 1] = cluster_points(points, mask, **cluster_kwargs)
+            record['clusters'].append(labels.tolist())
+
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def read_batch(fp) -> dict:
+    '''
+    Records of a batch_hotspots() output file by structure name, with
+    hotspots (and clusters) as (residues, features) arrays. An incomplete
+    last line (eg from an interrupted run) is skipped.
+    '''
+    records = {}
+    if not Path(fp).exists():
+        return records
+
+    with open(fp, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            for key in ('hotspots', 'clusters'):
+                if key in record:
+                    record[key] = np.array(record[key], dtype=np.int64).T
+            records[record['name']] = record
+    return records
+
+
+def _open_batch(fp):
+    '''
+    Open a batch_hotspots() output file for appending. After an interrupted
+    write, the last line is incomplete; new records start on a new line so
+    that only the broken one is skipped by read_batch().
+    '''
+    out = open(fp, 'a')
+    if out.tell() > 0:
+        with open(fp, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                out.write('\n')
+    return out
+
+
+def _write_record(out, record, quiet):
+    out.write(json.dumps(record) + '\n')
+    out.flush()
+    if not quiet:
+        print(f'{record["name"]}: {record["seconds"]} s')
+
+
+def batch_hotspots(folds, features, outfile, method: Literal['getis_ord', 'moran'] = 'getis_ord', angstrom=8, coordinates='alpha_carbons', cluster_kwargs=None, workers=None, resume=True, quiet=True, **kwargs) -> int:
+    '''
+    from foldvis.models import FoldCollection
+    from foldvis.stats import batch_hotspots, read_batch
+
+    folds = FoldCollection('proteome/', load='ca')
+    for fold in folds:
+        fold.add_bfactor('plddt')
+    batch_hotspots(folds, ['plddt'], 'hotspots.jsonl', cluster_kwargs={'min_cluster_size': 3}, seed=42)
+    results = read_batch('hotspots.jsonl')
+
+    find_hotspots() (and optionally cluster() on the hotspots of each feature)
+    for many structures. With more than one of <workers>, residue
+    coordinates and feature matrices of all structures are copied once into
+    shared memory, so the jobs sent to the worker processes (one per
+    structure) are just names and offsets, no folds are pickled.
+
+    features .. annotation keys (see feature_matrix()), or a function that
+    returns a (residues, features) matrix for a fold
+
+    Results are appended to <outfile> (JSON lines) as jobs finish, each with
+    the time it took ("seconds"). With <resume>, structures already in the
+    file are skipped, so an interrupted run can be continued (a record cut
+    off mid-line is computed again). Other
+    arguments (eg permutations, seed, sequential) are passed to hotspots();
+    a <seed> gives the same results for a structure in any run. Returns the
+    number of structures processed.
+    '''
+    done = read_batch(outfile) if resume else {}
+    if not resume:
+        Path(outfile).unlink(missing_ok=True)
+
+    names, points, matrices = [], [], []
+    for fold in folds:
+        name = str(fold.path)
+        if name in done:
+            continue
+        names.append(name)
+        points.append(get_residue_coordinates(fold, coordinates).astype(np.float64))
+        if callable(features):
+            X = features(fold)
+        else:
+            X = feature_matrix(fold, features)
+        matrices.append(np.asarray(X, dtype=np.float64).reshape(len(points[-1]), -1))
+
+    if not names:
+        return 0
+
+    params = (method, angstrom, cluster_kwargs, kwargs)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        # In this process, no need for shared memory
+        with _open_batch(outfile) as out:
+            for job in zip(names, points, matrices):
+                _write_record(out, _batch_job(*job, *params), quiet)
+        return len(names)
+
+    ends = np.cumsum([len(i) for i in points])
+    sizes = np.cumsum([i.size for i in matrices])
+    jobs = [
+        (name, (e - len(p), e), (z - X.size, z), X.shape[1])
+        for name, p, X, e, z in zip(names, points, matrices, ends, sizes)]
+    coords_shm, coords = _share(np.concatenate(points))
+    features_shm, flat = _share(np.concatenate([i.ravel() for i in matrices]))
+    del points, matrices
+
+    args = (coords, flat)
+    try:
+        # Bounded number of pending jobs, like FoldCollection
+        with _open_batch(outfile) as out, ProcessPoolExecutor(workers) as executor:
+            pending = set()
+            for job in jobs:
+                pending.add(executor.submit(_shared_batch_job, *args, job, *params))
+                if len(pending) >= 2 * workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        _write_record(out, f.result(), quiet)
+            for f in as_completed(pending):
+                _write_record(out, f.result(), quiet)
+    finally:
+        for shm in (coords_shm, features_shm):
+            shm.close()
+            shm.unlink()
+
+    return len(names)
+
+
 
 # 
 
@@ -2,6 +2,7 @@ import collections
 from itertools import combinations
 from math import log, e
 from pathlib import Path
+import re
 import subprocess
 from typing import Union
 import tempfile
@@ -185,6 +186,80 @@ def align_structures(query: Structure, target: Structure, mode=0, minscore=0.5):
     return round(float(score), 4), np.array(rotation).T, np.array(translation)
 
 
+def _read_alignments(fp, n):
+    '''
+    TM-scores, rotations and translations of <n> targets from an aln2tmscore
+    table (createtsv), where targets are named by their index, eg "3.pdb".
+    Targets without an alignment (below the TM-score threshold) are NaN, if
+    several are listed (eg one per chain) the best one is kept.
+    '''
+    tmscores = np.full(n, np.nan)
+    rotations = np.full((n, 3, 3), np.nan)
+    translations = np.full((n, 3), np.nan)
+
+    with open(fp, 'r') as file:
+        for line in file:
+            qry, rest = line.strip().split('\t')
+            ref, score, *rest = rest.split(' ')
+            # foldseek appends the chain to multi-chain entries, eg "3.pdb_A"
+            i = int(re.match(r'\d+', ref).group(0))
+            score = float(score)
+            if score <= np.nan_to_num(tmscores[i], nan=-1):
+                continue
+            rest = [float(j) for j in rest]
+            tmscores[i] = round(score, 4)
+            translations[i] = rest[:3]
+            # Transpose rotation matrix, see align_structures()
+            rotations[i] = np.array(rest[3:12]).reshape(3, 3).T
+
+    return tmscores, rotations, translations
+
+
+def align_many(query, targets, mode=0, minscore=0.5, threads=None):
+    '''
+    from foldvis.utils import align_many
+
+    tmscores, rotations, translations = align_many('ref.pdb', paths)
+    aligned = [Fold(p).transform(rot, tra) for p, rot, tra in zip(
+        paths, rotations, translations)]
+
+    Align all <targets> onto <query> with one foldseek pipeline: one database
+    for the query, one for all targets and a single search, instead of five
+    commands per pair as in align_structures() (see there for <mode> and
+    <minscore>). The search is exhaustive, so every target is aligned.
+
+    Returns TM-scores (n,), rotations (n, 3, 3) and translations (n, 3) in
+    the order of <targets>, in the convention of .transform(). Targets below
+    <minscore> are NaN.
+
+    Targets can be paths or folds (anything with a .path). Files are linked
+    into the database directory under their index, so files of the same
+    name in different directories do not clash.
+    '''
+    paths = [Path(getattr(i, 'path', i)).resolve() for i in targets]
+    query = Path(getattr(query, 'path', query)).resolve()
+    threads = ['--threads', str(threads)] if threads else []
+
+    with tempfile.TemporaryDirectory() as p:
+        indir = Path(p) / 'targets'
+        indir.mkdir()
+        for i, fp in enumerate(paths):
+            (indir / f'{i}{"".join(fp.suffixes)}').symlink_to(fp)
+
+        steps = [
+            ['foldseek', 'createdb', str(indir), f'{p}/targetDB', *threads],
+            ['foldseek', 'createdb', str(query), f'{p}/queryDB', *threads],
+            ['foldseek', 'search', f'{p}/queryDB', f'{p}/targetDB', f'{p}/aln', f'{p}/tmp', '-a', '--exhaustive-search', '1', '--max-seqs', str(max(len(paths), 1)), '--cov-mode', str(mode), '--tmscore-threshold', str(minscore), *threads],
+            ['foldseek', 'aln2tmscore', f'{p}/queryDB', f'{p}/targetDB', f'{p}/aln', f'{p}/aln_tmscore', *threads],
+            ['foldseek', 'createtsv', f'{p}/queryDB', f'{p}/targetDB', f'{p}/aln_tmscore', f'{p}/aln_tmscore.tsv', *threads],
+        ]
+        for step in steps:
+            log = subprocess.run(step, capture_output=True)
+            assert log.returncode == 0, log.stderr
+
+        return _read_alignments(f'{p}/aln_tmscore.tsv', len(paths))
+
+
 def transform_(structure: Structure, translation: np.ndarray, rotation: np.ndarray):
     '''
     DEPRECATED, can use "structure.transform(rotation, translation)"
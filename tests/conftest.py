@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    '''Keep the parse cache of the tests out of ~/.cache/foldvis'''
+    monkeypatch.setenv('FOLDVIS_CACHE', str(tmp_path / 'cache'))
@@ -1,9 +1,16 @@
 from pathlib import Path
 
 from libpysal.weights import DistanceBand
+import numpy as np
 
-from foldvis.models import Fold
-from foldvis.geometry import get_alpha_carbon_atoms, is_close
+from foldvis.io import hash_file
+from foldvis.models import Complex, Fold
+from foldvis.geometry import (
+    _3di_entry, count_within, distance_matrix, distance_to_closest_active_site,
+    distance_to_positions, get_3di_states, get_alpha_carbon_atoms,
+    get_alpha_carbon_coords, get_complex_interface, get_interfaces,
+    get_residue_coordinates, is_close, neighbors_within, residue_index,
+    solvent_accessibility, superimpose)
 
 
 def test_distance_band():
@@ -26,3 +33,225 @@ def test_distance_band():
         foo = [ix for ix, u in enumerate(x[i]) if u and ix != i] 
         bar = list(dist.neighbors[i])
         assert foo == bar
+
+
+def test_atom_table_center_of_mass():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    expected = [r.center_of_mass() for r in model.structure.get_residues()]
+    assert np.allclose(model.atoms.centers_of_mass(), expected, atol=1e-4)
+
+
+def test_neighbors_within():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    nb = neighbors_within(model, 8)
+    dist = DistanceBand(get_alpha_carbon_coords(model), 8, p=2, binary=True)
+    for i in range(len(model)):
+        assert sorted(nb[i].indices) == sorted(dist.neighbors[i])
+    assert list(count_within(model, 8)) == [len(dist.neighbors[i]) for i in range(len(model))]
+
+
+def test_distance_to_closest_active_site():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    bf = np.zeros((len(model), 2))
+    bf[[3, 10, 20], 0] = 1
+    bf[50, 1] = .6
+    d = distance_to_closest_active_site(model, bf, [.5, .9])
+
+    com = model.atoms.centers_of_mass()
+    expected = np.linalg.norm(com[:, None] - com[[3, 10, 20]][None], axis=2).min(axis=1)
+    assert d.shape == (len(model), 4)
+    assert np.allclose(d[:, 0], expected, atol=1e-4)
+    assert np.allclose(d[:, 1], expected, atol=1e-4)
+    assert d[50, 2] == 0 and np.isinf(d[:, 3]).all()
+    assert np.allclose(distance_to_closest_active_site(model, bf[:, 0]), expected, atol=1e-4)
+
+
+def test_distance_to_positions_by_chain():
+    here = Path(__file__).parent
+    rel = 'data/3V8X/complex/test_cacad_unrelaxed_rank_1_model_3.pdb'
+    cx = Complex(here.parent / rel)
+    n = len(cx.atoms.sequence('B'))
+
+    ix = residue_index(cx, {'B': [1, 2], 'C': [10]})
+    assert list(ix) == [0, 1, n + 9]
+
+    ca = get_alpha_carbon_coords(cx)
+    expected = np.linalg.norm(ca[:, None] - ca[ix][None], axis=2).min(axis=1)
+    d = distance_to_positions(cx, {'B': [1, 2], 'C': [10]})
+    assert np.allclose(d, expected, atol=1e-4)
+    assert np.allclose(distance_to_positions(cx, list(ix) + [10**6]), expected, atol=1e-4)
+
+
+def test_complex_interfaces():
+    here = Path(__file__).parent
+    rel = 'data/3V8X/complex/test_cacad_unrelaxed_rank_1_model_3.pdb'
+    cx = Complex(here.parent / rel)
+
+    # Same as a distance band over all alpha carbons, restricted to contacts
+    # between chains
+    ca = get_alpha_carbon_coords(cx)
+    chains = cx.ca_atoms.chains[cx.ca_atoms.alpha_carbons()]
+    dist = DistanceBand(ca, 6, p=2, binary=True)
+    expected = {
+        k for k, v in dist.neighbors.items()
+        for i in v if chains[i] != chains[k]}
+    assert get_complex_interface(cx, 6) == expected
+    assert get_complex_interface(cx, 6, chain='B') == {
+        i for i in expected if chains[i] == 'B'}
+
+    df = get_interfaces(cx, 5, 'heavy')
+    assert set(df.chain_a) == {'B'} and set(df.chain_b) == {'C'}
+    assert (df.distance < 5).all()
+    assert len(get_interfaces(cx, 5, 'side_chain')) <= len(df)
+
+
+def test_distance_matrix(tmp_path):
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    ca = get_alpha_carbon_coords(model)
+    expected = np.linalg.norm(ca[:, None] - ca[None], axis=2)
+    assert np.allclose(model.distance_matrix(), expected, atol=1e-4)
+
+    # Minimum heavy atom distance, tiles smaller than a residue row
+    residues = list(model.structure.get_residues())
+    heavy = [np.array([a.coord for a in r if a.element != 'H']) for r in residues]
+    i, j = 3, 40
+    d = np.linalg.norm(heavy[i][:, None] - heavy[j][None], axis=2).min()
+    D = distance_matrix(model, 'heavy', memory=1000)
+    assert np.isclose(D[i, j], d, atol=1e-4) and np.allclose(D, D.T)
+
+    S = distance_matrix(model, 'heavy', output='sparse', cutoff=5)
+    mask = D < 5
+    np.fill_diagonal(mask, False)
+    assert S.nnz == mask.sum() and np.allclose(S.toarray()[mask], D[mask])
+
+    fp = tmp_path / 'distances.npy'
+    distance_matrix(model, 'centroid', output='memmap', path=fp)
+    assert np.array_equal(
+        np.load(fp, mmap_mode='r'), distance_matrix(model, 'centroid'))
+
+    C = model.contact_map(8)
+    assert C.dtype == bool and C.diagonal().all()
+    assert (model.contact_map(8, sparse=True).toarray() | np.eye(len(C), dtype=bool) == C).all()
+
+
+def test_distance_matrix_missing_alpha_carbon(tmp_path):
+    # Residues without a CA atom are common in crystal structures
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    lines = p.read_text().splitlines()
+    ca = [n for n, l in enumerate(lines) if l[12:16] == ' CA ']
+    fp = tmp_path / 'missing_ca.pdb'
+    fp.write_text('\n'.join(lines[:ca[10]] + lines[ca[10] + 1:]))
+    model, full = Fold(fp), Fold(p)
+
+    n = len(model.sequence)
+    for representation in ('beta_carbons', 'centroid', 'heavy'):
+        D = distance_matrix(model, representation)
+        assert D.shape == (n, n)
+        assert model.contact_map(8, representation).shape == (n, n)
+    # The residue still has its beta carbon
+    assert np.allclose(distance_matrix(model, 'beta_carbons'), distance_matrix(full, 'beta_carbons'))
+
+
+def test_side_chain_centroids():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    expected = []
+    for res in model.structure.get_residues():
+        side = [a.coord for a in res if a.get_id() not in ('N', 'CA', 'C', 'O', 'OXT')]
+        # Glycine has no side chain, use the alpha carbon
+        expected.append(np.mean(side, axis=0) if side else res['CA'].coord)
+    result = get_residue_coordinates(model, 'side_chain')
+    assert np.allclose(result, expected, atol=1e-4)
+
+    centroids = [np.mean([a.coord for a in res], axis=0) for res in model.structure.get_residues()]
+    assert np.allclose(get_residue_coordinates(model, 'centroid'), centroids, atol=1e-4)
+
+
+def test_side_chain_centroids_missing_alpha_carbon(tmp_path):
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    full = Fold(p)
+    # No CA in a glycine (30) and in a residue with a side chain (10)
+    lines = p.read_text().splitlines()
+    ca = [n for n, l in enumerate(lines) if l[12:16] == ' CA ']
+    fp = tmp_path / 'missing_ca.pdb'
+    fp.write_text('\n'.join(l for n, l in enumerate(lines) if n not in (ca[10], ca[30])))
+    model = Fold(fp)
+
+    points = get_residue_coordinates(model, 'side_chain')
+    expected = get_residue_coordinates(full, 'side_chain')
+    assert points.shape == expected.shape
+    keep = np.arange(len(points)) != 30
+    assert np.allclose(points[keep], expected[keep])
+    # Glycine without CA falls back to the centroid of its other atoms
+    assert np.allclose(points[30], model.atoms.centroids()[30])
+    assert neighbors_within(model, 8, 'side_chain').shape == (len(points), len(points))
+
+
+def test_solvent_accessibility():
+    from Bio.PDB.SASA import ShrakeRupley
+
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    structure = model.atoms.to_structure()
+    ShrakeRupley().compute(structure, level='R')
+    expected = [r.sasa for r in structure.get_residues()]
+    # Small batches split the atom pairs over many steps
+    result = solvent_accessibility(model, relative=False, batch=1000)
+    assert np.allclose(result, expected)
+
+    model.add_solvent_accessibility()
+    rsa = np.array(model.annotation['rsa'])
+    assert len(rsa) == len(model) and (rsa >= 0).all()
+
+
+def test_superimpose():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+
+    # Undo a rigid transformation
+    a, b = np.cos(1.0), np.sin(1.0)
+    rot = np.array([[a, -b, 0], [b, a, 0], [0, 0, 1]])
+    moved = model.transform(rot, np.array([3.0, -7.0, 20.0]))
+    tmscore, rmsd, *_ = superimpose(
+        get_alpha_carbon_coords(moved), get_alpha_carbon_coords(model))
+    assert np.isclose(tmscore, 1) and rmsd < 1e-3
+
+    tmscore, aligned = moved.align_to(model)
+    assert tmscore == 1 and aligned.transformed
+    assert np.allclose(
+        get_alpha_carbon_coords(aligned), get_alpha_carbon_coords(model), atol=1e-3)
+
+
+def test_3di_states_cache(tmp_path, monkeypatch):
+    # Cached strings are keyed on file content, foldseek is not called when
+    # all structures are in the cache
+    monkeypatch.setenv('FOLDVIS_CACHE', str(tmp_path / 'cache'))
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    copy = tmp_path / 'copy.pdb'
+    copy.write_bytes(p.read_bytes())
+
+    entry = _3di_entry(hash_file(p))
+    entry.parent.mkdir(parents=True)
+    entry.write_text('DVVLVV')
+
+    assert get_3di_states([Fold(p), copy]) == ['DVVLVV', 'DVVLVV']
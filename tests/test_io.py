@@ -0,0 +1,106 @@
+import gzip
+import json
+from io import StringIO
+from pathlib import Path
+
+from Bio.PDB import MMCIFIO, PDBParser
+import numpy as np
+
+from foldvis.atoms import AtomTable
+from foldvis.io import format_pdb, load_atoms, load_bfactor_column, read_atoms, read_cached_atoms, read_pdb, save_pdb
+
+
+def test_read_atoms():
+    '''
+    The fixed-width reader should give the same table as the PDBParser, here
+    on a file with HETATM records.
+    '''
+    here = Path(__file__).parent
+    p = here.parent / 'data/1BXW.pdb'
+
+    expected = AtomTable.from_structure(
+        PDBParser(QUIET=True).get_structure('x', p))
+    table = read_atoms(p)
+
+    for k in ['names', 'elements', 'res_names', 'res_ids', 'res_chains', 'res_hetero', 'offsets']:
+        assert np.array_equal(getattr(table, k), getattr(expected, k))
+    assert np.allclose(table.coords, expected.coords)
+    assert np.allclose(table.bfactors, expected.bfactors)
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('FOLDVIS_CACHE', str(tmp_path))
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+
+    assert read_cached_atoms(p) is None
+    table = load_atoms(p)
+    cached = read_cached_atoms(p)
+    assert cached is not None
+
+    for k, v in table.arrays().items():
+        assert np.array_equal(getattr(cached, k), v)
+    assert cached.sequence() == table.sequence()
+
+    # A cache location that is not a directory only disables the cache
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setenv('FOLDVIS_CACHE', str(blocker))
+    assert read_cached_atoms(p) is None
+    assert load_atoms(p).sequence() == table.sequence()
+
+
+def test_format_pdb():
+    '''
+    Bulk formatting should give the same text as PDBIO.
+    '''
+    here = Path(__file__).parent
+    p = here.parent / 'data/3V8X/complex/test_cacad_unrelaxed_rank_1_model_3.pdb'
+    table = read_atoms(p)
+
+    expected = save_pdb(table.to_structure(), StringIO()).getvalue()
+    assert format_pdb(table) == expected
+
+
+def test_read_pdb_models(tmp_path):
+    '''
+    read_pdb() keeps all models, read_atoms() (and fast=True) the first one.
+    '''
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    atoms = [i for i in p.read_text().splitlines() if i.startswith('ATOM')]
+    fp = tmp_path / 'models.pdb'
+    fp.write_text('\n'.join(
+        ['MODEL        1', *atoms, 'ENDMDL', 'MODEL        2', *atoms, 'ENDMDL', 'END']))
+
+    assert len(read_pdb(fp)) == 2
+    assert len(read_pdb(fp, fast=True)) == 1
+    assert len(read_atoms(fp)) == len(atoms)
+
+
+def test_read_compressed_cif(tmp_path):
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    expected = read_atoms(p)
+
+    cif = MMCIFIO()
+    cif.set_structure(PDBParser(QUIET=True).get_structure('x', p))
+    stream = StringIO()
+    cif.save(stream)
+    with gzip.open(tmp_path / 'model.cif.gz', 'wt') as out:
+        out.write(stream.getvalue())
+
+    table = read_atoms(tmp_path / 'model.cif.gz')
+    assert table.sequence() == expected.sequence()
+    assert np.array_equal(table.names, expected.names)
+    assert np.allclose(table.coords, expected.coords)
+
+
+def test_load_bfactor_column():
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    with open(str(p).replace('.pdb', '_scores.json'), 'r') as file:
+        plddt = json.load(file)['plddt']
+
+    for how in ['first', 'mean', 'min', 'ca']:
+        assert np.allclose(load_bfactor_column(p, how, cache=False), plddt, atol=0.01)
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+import numpy as np
+
+from foldvis.geometry import get_alpha_carbon_coords
+from foldvis.models import AlphaFold, Fold, FoldCollection
+
+
+def test_fold_collection(tmp_path):
+    here = Path(__file__).parent
+    indir = here.parent / 'data/1AAY_alphafold'
+    broken = tmp_path / 'broken.pdb'
+    broken.write_text('nothing to see here\n')
+
+    paths = sorted(indir.glob('*.pdb')) + [broken]
+    folds = FoldCollection(paths, workers=2, chunksize=2, cache=False)
+
+    assert len(folds) == 5
+    assert [i.path for i in folds] == paths[:-1]
+    assert list(folds.failed) == [broken]
+    assert folds[0].sequence == Fold(paths[0], cache=False).sequence
+
+
+def test_reduced_load_modes():
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    full = Fold(p, cache=False)
+    ca = Fold(p, cache=False, load='ca')
+    seq = Fold(p, cache=False, load='sequence')
+
+    assert full.sequence == ca.sequence == seq.sequence
+    assert np.allclose(get_alpha_carbon_coords(full), get_alpha_carbon_coords(ca))
+    # Only alpha carbons were read
+    assert ca._atoms is None
+    assert len(ca.ca_atoms) == len(ca)
+    # ... the rest is loaded on demand
+    assert len(seq.atoms) == len(full.atoms)
+
+
+def test_add_bfactor(tmp_path):
+    # Different B-factors for the atoms of a residue, same result for a fold
+    # that has only read the alpha carbons
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    lines = p.read_text().splitlines()
+    fp = tmp_path / 'bfactors.pdb'
+    fp.write_text('\n'.join(
+        f'{l[:60]}{n % 97:6.2f}{l[66:]}' if l.startswith('ATOM') else l
+        for n, l in enumerate(lines)))
+
+    full = Fold(fp, cache=False)
+    for how in ['ca', 'first', 'mean', 'min', 'max']:
+        lazy = Fold(fp, cache=False, load='ca')
+        full.add_bfactor(how, how)
+        lazy.add_bfactor(how, how)
+        assert np.allclose(full.annotation[how], lazy.annotation[how])
+    assert not np.allclose(full.annotation['mean'], full.annotation['ca'])
+
+
+def test_transform_shares_labels():
+    here = Path(__file__).parent
+    p = here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    fold = Fold(p, cache=False)
+    before = fold.atoms.coords.copy()
+
+    rot = np.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]], dtype=float)
+    moved = fold.transform(rot, np.array([1., 2., 3.]))
+
+    assert np.shares_memory(moved.atoms.names, fold.atoms.names)
+    assert np.allclose(moved.atoms.coords, before @ rot + [1, 2, 3], atol=1e-4)
+    assert np.array_equal(fold.atoms.coords, before)
+
+
+def test_alphafold_same_sequence_alignment():
+    # The models share a sequence, so no foldseek is needed to align them
+    here = Path(__file__).parent
+    af = AlphaFold(here.parent / 'data/1AAY_alphafold', cache=False)
+
+    assert len(af.models) == 5
+    assert all(af.models[i].transformed for i in range(2, 6))
+    assert [af.models[i].atoms.res_chains[0] for i in range(2, 6)] == list('BCDE')
@@ -1,7 +1,16 @@
 from pathlib import Path
 
-from foldvis.models import Fold
-from foldvis.geometry import get_alpha_carbon_atoms
+from esda.getisord import G_Local
+from esda.moran import Moran_Local
+from libpysal.weights import DistanceBand
+import numpy as np
+
+from foldvis.models import Fold, FoldCollection
+from foldvis.geometry import get_alpha_carbon_atoms, get_alpha_carbon_coords
+from foldvis.stats import (
+    _ATTACHED, batch_hotspots, cluster, cluster_sweep, feature_matrix,
+    find_hotspots, local_statistic, permutation_test, read_batch,
+    spatial_weights)
 
 
 
@@ -15,4 +24,138 @@ def test_get_alpha_carbon_coords():
     p = here.parent / rel
     model = Fold(p)
     assert \
-    len(model.sequence) == len(list(get_alpha_carbon_atoms(model)))
\ No newline at end of file
+    len(model.sequence) == len(list(get_alpha_carbon_atoms(model)))
+
+
+def test_local_statistic():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+    model.add_bfactor('plddt')
+    model.annotate_('hydrophobic', [int(i in 'AVILMFWC') for i in model.sequence])
+    X = feature_matrix(model, ['plddt', 'hydrophobic'])
+
+    dist = DistanceBand(get_alpha_carbon_coords(model), 8, p=2, binary=True)
+    assert (spatial_weights(model, 8) != dist.sparse).nnz == 0
+
+    G = local_statistic(X, spatial_weights(model, 8, star=True))
+    I = local_statistic(X, spatial_weights(model, 8), 'moran')
+    for n, x in enumerate(X.T):
+        g = G_Local(x, dist, 'B', permutations=0, star=True)
+        i = Moran_Local(x, dist, 'B', permutations=0)
+        assert np.allclose(G[:, n], g.Gs) and np.allclose(I[:, n], i.Is)
+
+    assert find_hotspots(model, X).shape == X.shape
+
+
+def test_permutation_test():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+    model.add_bfactor('plddt')
+    x = np.array(model.annotation['plddt'])
+    hydrophobic = np.array([int(i in 'AVILMFWC') for i in model.sequence])
+    X = np.column_stack([x, hydrophobic])
+
+    W = spatial_weights(model, 8, star=True)
+    result = permutation_test(X, W, permutations=999, seed=1)
+    assert np.allclose(result.statistic, (W @ X) / X.sum(axis=0))
+
+    # Reproducible, and independent of the number of processes
+    for n_jobs in (2, -1, None):
+        again = permutation_test(X, W, permutations=999, seed=1, n_jobs=n_jobs)
+        assert all(np.array_equal(a, b, equal_nan=True) for a, b in zip(result, again))
+
+    # Binary weights take a shortcut, scaled weights the general path
+    scaled = permutation_test(X, W * 2, permutations=999, seed=1)
+    assert np.allclose(result.z_sim, scaled.z_sim)
+    assert np.array_equal(result.p_sim, scaled.p_sim)
+
+    # Same distribution as esda's conditional randomization
+    dist = DistanceBand(get_alpha_carbon_coords(model), 8, p=2, binary=True)
+    local = G_Local(x, dist, 'B', permutations=999, star=True, seed=1)
+    assert np.corrcoef(local.z_sim, result.z_sim[:, 0])[0, 1] > 0.99
+
+
+def test_sequential_permutation_test():
+    here = Path(__file__).parent
+    rel = 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb'
+    model = Fold(here.parent / rel)
+    model.add_bfactor('plddt')
+    x = np.array(model.annotation['plddt'])
+
+    W = spatial_weights(model, 8, star=True)
+    full = permutation_test(x, W, permutations=4999, seed=1)
+    seq = permutation_test(x, W, permutations=4999, seed=1, sequential=True, alpha=0.05)
+
+    # Clearly non-significant residues stop early, the others see the same
+    # permutations as without <sequential>
+    stopped = seq.permutations < 4999
+    assert stopped.any() and seq.permutations.sum() < full.permutations.sum() / 2
+    assert (seq.p_sim[stopped] > 0.05).all() and (seq.p_z_sim[stopped] > 0.05).all()
+    assert np.array_equal(seq.p_sim[~stopped], full.p_sim[~stopped])
+    assert np.allclose(seq.z_sim[~stopped], full.z_sim[~stopped])
+
+    # Same hotspots, whichever p-value the FDR is applied to
+    for pvalue in ('z_sim', 'sim'):
+        kwargs = {'permutations': 4999, 'seed': 1, 'pvalue': pvalue}
+        hotspots = find_hotspots(model, x, sequential=True, **kwargs)
+        assert hotspots == find_hotspots(model, x, **kwargs) and sum(hotspots) > 0
+
+
+def test_batch_hotspots(tmp_path):
+    here = Path(__file__).parent
+    folds = FoldCollection(here.parent / 'data/1AAY_alphafold', workers=1, load='ca')
+    for fold in folds:
+        fold.add_bfactor('plddt')
+
+    # Interrupted run: only some structures are in the output
+    out = tmp_path / 'hotspots.jsonl'
+    kwargs = {'cluster_kwargs': {'min_cluster_size': 3}, 'seed': 1, 'permutations': 199}
+    assert batch_hotspots(folds[:2], ['plddt'], out, workers=1, **kwargs) == 2
+    assert not _ATTACHED
+    # ... and the last record was cut off mid-line
+    text = out.read_text()
+    out.write_text(text[:-len(text.splitlines()[-1]) // 2])
+    assert batch_hotspots(folds, ['plddt'], out, workers=2, **kwargs) == 4
+    results = read_batch(out)
+    assert len(results) == 5
+
+    # Same results in one go, in any process
+    again = tmp_path / 'again.jsonl'
+    batch_hotspots(folds, ['plddt'], again, workers=1, **kwargs)
+    for name, record in read_batch(again).items():
+        assert np.array_equal(record['hotspots'], results[name]['hotspots'])
+        assert np.array_equal(record['clusters'], results[name]['clusters'])
+        assert record['hotspots'].shape == (record['residues'], 1)
+        assert record['seconds'] > 0
+
+
+def test_cluster_sweep(monkeypatch):
+    here = Path(__file__).parent
+    model = Fold(here.parent / 'data/1AAY_alphafold/test_676a7_unrelaxed_rank_1_model_2.pdb')
+    mask = np.random.default_rng(0).random(len(model.ca_atoms)) < 0.5
+
+    sizes, samples = [2, 3, 5, 8], [1, 3]
+    labels = cluster_sweep(model, mask, sizes, samples)
+    assert set(labels) == {(m, s) for m in sizes for s in samples}
+    for (m, s), l in labels.items():
+        assert np.array_equal(l, cluster(model, mask, min_cluster_size=m, min_samples=s))
+
+    # One tree per min_samples, reused across sizes and calls
+    def trees():
+        return [k for k in model.ca_atoms._cache if k[0] == 'single_linkage']
+    assert len(trees()) == len(samples)
+    leaf = cluster_sweep(model, mask, [3], [3], cluster_selection_method='leaf')
+    assert len(trees()) == len(samples)
+    assert np.array_equal(leaf[(3, 3)], cluster(
+        model, mask, min_cluster_size=3, min_samples=3,
+        cluster_selection_method='leaf'))
+
+    # Without the hdbscan internals, each combination is fit from scratch
+    def missing(*args):
+        raise ImportError
+    monkeypatch.setattr('foldvis.stats._single_linkage', missing)
+    monkeypatch.setattr('foldvis.stats._tree_labels', missing)
+    fallback = cluster_sweep(Fold(model.path), mask, sizes, samples)
+    assert all(np.array_equal(v, labels[k]) for k, v in fallback.items())
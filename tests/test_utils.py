@@ -0,0 +1,21 @@
+import numpy as np
+
+from foldvis.utils import _read_alignments
+
+
+def test_read_alignments(tmp_path):
+    # createtsv output of aln2tmscore: query, target, TM-score, translation
+    # and (row-major) rotation, rotation is returned transposed
+    rot = np.arange(9, dtype=float).reshape(3, 3)
+    fields = ' '.join(str(i) for i in [1, 2, 3] + rot.flatten().tolist())
+    fp = tmp_path / 'aln_tmscore.tsv'
+    fp.write_text(
+        f'ref.pdb\t1.pdb 0.81234 {fields}\n'
+        f'ref.pdb\t2.pdb_A 0.6 {fields}\n'
+        f'ref.pdb\t2.pdb_B 0.7 {fields}\n')
+
+    tmscores, rotations, translations = _read_alignments(fp, 3)
+    assert np.isnan(tmscores[0]) and np.isnan(rotations[0]).all()
+    assert tmscores[1] == 0.8123 and tmscores[2] == 0.7
+    assert np.array_equal(rotations[1], rot.T)
+    assert np.array_equal(translations[2], [1, 2, 3])